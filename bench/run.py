@@ -0,0 +1,420 @@
+"""
+Нагрузочный тест бота на локальных заглушках Яндекс.Музыки и Telegram.
+
+Пример:
+    python -m bench.run --target handle_url --requests 200 --concurrency 1,8,32
+
+Для каждого уровня параллельности выводятся запросы в секунду, перцентили
+полного запроса и этапов обработки, пиковая память и число открытых файлов
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+import resource
+import tempfile
+from datetime import datetime
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.types import Chat, Message, User
+from prometheus_client import Histogram
+from yandex_music import DownloadInfo
+
+from bot import cache, file_cache, search_index
+from bot.cache import init_track_cache, DEFAULT_TTL
+from bot.file_cache import init_audio_cache
+from bot.search_index import init_search_index
+from bot.http_client import init_http_session, close_http_session
+from bot.scheduler import init_job_scheduler
+from bot.services import download_yandex_music_track, release_download
+from bot.yandex_clients import init_client_pool
+from bot.handlers import handle_url
+from bot.throttle import TelegramThrottle
+from bot.metrics import REQUESTS, STAGE_LATENCY
+from bench.stubs import StubConfig, StubServers
+
+logger = logging.getLogger("bench")
+
+BOT_TOKEN = "42:BENCH"
+PERCENTILES = (0.5, 0.95, 0.99)
+SAMPLE_INTERVAL = 0.02
+
+# Номера треков каждого уровня не пересекаются, чтобы кэши одного уровня
+# не влияли на следующий
+TRACK_ID_BASE = 1_000_000
+TRACK_ID_STEP = 1_000_000
+
+
+def use_plain_http_cdn():
+    """
+    Библиотека всегда строит прямую ссылку со схемой https,
+    а заглушка CDN работает по http
+    """
+    original = DownloadInfo.get_direct_link_async
+
+    async def get_direct_link_async(self, *args, **kwargs):
+        link = await original(self, *args, **kwargs)
+        self.direct_link = link.replace("https://", "http://", 1)
+        return self.direct_link
+
+    DownloadInfo.get_direct_link_async = get_direct_link_async
+
+
+class ResourceSampler:
+    """Периодический замер памяти (RSS) и открытых файловых дескрипторов процесса"""
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL):
+        self.interval = interval
+        self.peak_rss = 0
+        self.peak_fds = 0
+        self._task = None
+
+    @staticmethod
+    def rss() -> int:
+        try:
+            with open("/proc/self/statm") as f:
+                return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except OSError:
+            # Не Linux: доступен только пик за всё время работы процесса
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    @staticmethod
+    def open_fds() -> int:
+        try:
+            return len(os.listdir("/proc/self/fd"))
+        except OSError:
+            return 0
+
+    def sample(self):
+        self.peak_rss = max(self.peak_rss, self.rss())
+        self.peak_fds = max(self.peak_fds, self.open_fds())
+
+    async def _run(self):
+        while True:
+            self.sample()
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        self.sample()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self.sample()
+
+
+class StageRecorder:
+    """
+    Точные длительности этапов: каждое наблюдение гистограммы STAGE_LATENCY
+    сохраняется, а не только попадание в бакет
+    """
+
+    def __init__(self):
+        self.samples = {}
+        self._original = None
+
+    def install(self):
+        self._original = original = Histogram.observe
+        recorder = self
+
+        def observe(histogram, amount, *args, **kwargs):
+            if histogram._name == STAGE_LATENCY._name and histogram._labelvalues:
+                recorder.samples.setdefault(histogram._labelvalues[0], []).append(amount)
+            return original(histogram, amount, *args, **kwargs)
+
+        Histogram.observe = observe
+
+    def uninstall(self):
+        if self._original is not None:
+            Histogram.observe = self._original
+
+    def reset(self):
+        self.samples = {}
+
+    def report(self) -> dict:
+        return {
+            stage: {"count": len(values), **{q: percentile(values, q) for q in PERCENTILES}}
+            for stage, values in self.samples.items()
+        }
+
+
+def snapshot(metric) -> dict:
+    """Текущие значения всех сэмплов метрики Prometheus"""
+    values = {}
+    for family in metric.collect():
+        for sample in family.samples:
+            key = (sample.name, tuple(sorted(sample.labels.items())))
+            values[key] = sample.value
+    return values
+
+
+def diff(after: dict, before: dict) -> dict:
+    return {key: value - before.get(key, 0) for key, value in after.items()}
+
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, int(round(q * len(values) + 0.5)) - 1))
+    return values[index]
+
+
+def request_results(samples: dict) -> dict:
+    """Количество запросов по результату (sent, cached, error, ...)"""
+    results = {}
+    for (name, labels), value in samples.items():
+        if name.endswith("_total") and value:
+            result = dict(labels)["result"]
+            results[result] = results.get(result, 0) + int(value)
+    return results
+
+
+def track_url(track_id: int) -> str:
+    return f"https://music.yandex.ru/album/1/track/{track_id}"
+
+
+def make_message(bot: Bot, index: int, user_id: int, text: str) -> Message:
+    return Message(
+        message_id=index,
+        date=datetime.now(),
+        chat=Chat(id=user_id, type="private"),
+        from_user=User(id=user_id, is_bot=False, first_name="Bench"),
+        text=text,
+    ).as_(bot)
+
+
+async def run_level(args, bot: Bot, storage: MemoryStorage, recorder: StageRecorder,
+                    concurrency: int, level: int) -> dict:
+    """Прогон args.requests запросов с заданной параллельностью"""
+    first_id = TRACK_ID_BASE + level * TRACK_ID_STEP
+    distinct = args.distinct or args.requests
+    next_index = 0
+    latencies = []
+    failures = 0
+
+    async def one(index: int):
+        nonlocal failures
+        track_id = first_id + index % distinct
+        url = track_url(track_id)
+        started = time.perf_counter()
+        if args.target == "download":
+            result = await download_yandex_music_track(url)
+            release_download(result)
+            if not result["success"]:
+                failures += 1
+        else:
+            # У каждого запроса свой пользователь, как при независимых клиентах
+            user_id = first_id + index
+            message = make_message(bot, index, user_id, url)
+            state = FSMContext(storage=storage, key=StorageKey(bot.id, user_id, user_id))
+            try:
+                await handle_url(message, state)
+            except Exception as e:
+                # В боте такие ошибки (например, при отправке статуса) ловит диспетчер
+                logger.warning(f"Unhandled error in handle_url: {e}")
+                failures += 1
+        latencies.append(time.perf_counter() - started)
+
+    async def worker():
+        nonlocal next_index
+        while next_index < args.requests:
+            index = next_index
+            next_index += 1
+            await one(index)
+
+    recorder.reset()
+    requests_before = snapshot(REQUESTS)
+    sampler = ResourceSampler()
+    fds_before = sampler.open_fds()
+
+    sampler.start()
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    await sampler.stop()
+
+    report = {
+        "concurrency": concurrency,
+        "requests": args.requests,
+        "elapsed": elapsed,
+        "rps": args.requests / elapsed if elapsed else 0.0,
+        "latency": {q: percentile(latencies, q) for q in PERCENTILES},
+        "stages": recorder.report(),
+        "peak_rss": sampler.peak_rss,
+        "peak_fds": sampler.peak_fds,
+        "fds_before": fds_before,
+        "fds_after": sampler.open_fds(),
+    }
+    if args.target == "download":
+        report["results"] = {"success": args.requests - failures, "error": failures}
+    else:
+        report["results"] = request_results(diff(snapshot(REQUESTS), requests_before))
+        if failures:
+            report["results"]["unhandled"] = failures
+    return report
+
+
+def print_report(report: dict):
+    mb = 1024 * 1024
+    latency = report["latency"]
+    results = ", ".join(f"{name}={count}" for name, count in sorted(report["results"].items()))
+    print(f"\n=== concurrency {report['concurrency']} ===")
+    print(
+        f"requests: {report['requests']} in {report['elapsed']:.2f}s, "
+        f"{report['rps']:.1f} req/s ({results})"
+    )
+    print(
+        f"request latency: p50 {latency[0.5] * 1000:.0f} ms, "
+        f"p95 {latency[0.95] * 1000:.0f} ms, p99 {latency[0.99] * 1000:.0f} ms"
+    )
+    print(
+        f"peak RSS: {report['peak_rss'] / mb:.1f} MB, "
+        f"open FDs: peak {report['peak_fds']}, "
+        f"before {report['fds_before']}, after {report['fds_after']}"
+    )
+    if report["stages"]:
+        print(f"{'stage':<14}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+        for stage, values in sorted(report["stages"].items()):
+            print(
+                f"{stage:<14}{values['count']:>8}"
+                + "".join(f"{values[q] * 1000:>10.1f}" for q in PERCENTILES)
+            )
+
+
+def print_token_usage(stats: list):
+    print("\nYandex tokens: " + ", ".join(
+        f"{entry['name']}={entry['requests']}" + ("" if entry["available"] else " (disabled)")
+        for entry in stats
+    ))
+
+
+async def run(args):
+    config = StubConfig(
+        yandex_latency=args.yandex_latency_ms / 1000,
+        cdn_latency=args.cdn_latency_ms / 1000,
+        telegram_latency=args.telegram_latency_ms / 1000,
+        payload_size=args.payload_kb * 1024,
+        yandex_error_rate=args.yandex_error_rate,
+        cdn_error_rate=args.cdn_error_rate,
+        telegram_error_rate=args.telegram_error_rate,
+        telegram_chat_limit=args.telegram_chat_limit,
+        seed=args.seed,
+    )
+    use_plain_http_cdn()
+
+    with StubServers(config) as stubs, tempfile.TemporaryDirectory(prefix="ymbot-bench-") as workdir:
+        urls = stubs.urls
+        logger.info(f"Stub servers: {urls}")
+
+        # Токены заглушка не проверяет, важно только их число
+        pool = await init_client_pool(
+            [f"bench-token-{index}" for index in range(1, args.tokens + 1)], base_url=urls["yandex"]
+        )
+        init_track_cache(os.path.join(workdir, "tracks.db"), DEFAULT_TTL)
+        init_search_index(os.path.join(workdir, "search.db"))
+        init_audio_cache(os.path.join(workdir, "audio"), args.audio_cache_mb * 1024 * 1024)
+        init_http_session(
+            pool_limit_per_host=args.pool_limit_per_host,
+            stream_threshold=args.stream_threshold,
+        )
+        init_job_scheduler(
+            max_concurrent=args.max_jobs,
+            max_per_user=1,
+            max_queue=args.max_queue,
+        )
+
+        session = AiohttpSession(api=TelegramAPIServer.from_base(urls["telegram"]))
+        bot = Bot(token=BOT_TOKEN, session=session)
+        throttle = None
+        if not args.no_throttle:
+            throttle = TelegramThrottle()
+            bot.session.middleware(throttle)
+        storage = MemoryStorage()
+        recorder = StageRecorder()
+        recorder.install()
+
+        reports = []
+        try:
+            for level, concurrency in enumerate(args.concurrency):
+                report = await run_level(args, bot, storage, recorder, concurrency, level)
+                print_report(report)
+                reports.append(report)
+            print_token_usage(pool.stats())
+        finally:
+            recorder.uninstall()
+            if throttle is not None:
+                await throttle.drain()
+            await bot.session.close()
+            await close_http_session()
+            for module, name in ((cache, "track_cache"), (search_index, "search_index"),
+                                 (file_cache, "audio_cache")):
+                if getattr(module, name) is not None:
+                    getattr(module, name).close()
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(
+                {"target": args.target, "config": vars(config), "levels": reports},
+                f, indent=2, default=str
+            )
+    return reports
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота на локальных заглушках")
+    parser.add_argument("--target", choices=("handle_url", "download"), default="handle_url",
+                        help="handle_url - полный цикл с отправкой в Telegram, "
+                             "download - только download_yandex_music_track")
+    parser.add_argument("--requests", type=int, default=100, help="Запросов на каждом уровне")
+    parser.add_argument("--concurrency", type=lambda value: [int(x) for x in value.split(",")],
+                        default=[1, 8, 32], help="Уровни параллельности через запятую")
+    parser.add_argument("--distinct", type=int, default=0,
+                        help="Разных треков на уровне (0 - все запросы к разным трекам)")
+    parser.add_argument("--payload-kb", type=int, default=5 * 1024, help="Размер трека в КБ")
+    parser.add_argument("--tokens", type=int, default=1, help="Токенов в пуле клиентов Яндекс.Музыки")
+    parser.add_argument("--yandex-latency-ms", type=float, default=50)
+    parser.add_argument("--cdn-latency-ms", type=float, default=50)
+    parser.add_argument("--telegram-latency-ms", type=float, default=50)
+    parser.add_argument("--yandex-error-rate", type=float, default=0.0)
+    parser.add_argument("--cdn-error-rate", type=float, default=0.0)
+    parser.add_argument("--telegram-error-rate", type=float, default=0.0)
+    parser.add_argument("--telegram-chat-limit", type=float, default=0,
+                        help="Сообщений в секунду на чат, сверх которых заглушка отвечает 429")
+    parser.add_argument("--no-throttle", action="store_true",
+                        help="Без ограничителя частоты запросов к Telegram")
+    parser.add_argument("--stream-threshold", type=int, default=None,
+                        help="Порог потоковой отправки в байтах (как STREAM_UPLOAD_THRESHOLD)")
+    parser.add_argument("--max-jobs", type=int, default=4, help="Как MAX_CONCURRENT_JOBS")
+    parser.add_argument("--max-queue", type=int, default=100, help="Как MAX_QUEUE_SIZE")
+    parser.add_argument("--pool-limit-per-host", type=int, default=10, help="Как HTTP_POOL_LIMIT_PER_HOST")
+    parser.add_argument("--audio-cache-mb", type=int, default=0, help="Как AUDIO_CACHE_MAX_MB")
+    parser.add_argument("--seed", type=int, default=None, help="Seed для воспроизводимых ошибок")
+    parser.add_argument("--json", help="Сохранить результаты в JSON-файл")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Логи бота уровня INFO")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(
+        level=logging.INFO if args.verbose else logging.WARNING,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
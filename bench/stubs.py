@@ -0,0 +1,273 @@
+"""
+Локальные заглушки API Яндекс.Музыки, CDN и Telegram Bot API.
+Запускаются в отдельном процессе, чтобы не искажать замеры памяти
+и файловых дескрипторов бота
+"""
+import time
+import random
+import asyncio
+import multiprocessing
+from datetime import datetime, timezone
+from dataclasses import dataclass
+from aiohttp import web
+from bot.ratelimit import TokenBucket
+
+CHUNK_SIZE = 64 * 1024
+
+
+@dataclass
+class StubConfig:
+    """
+    Поведение заглушек: задержка ответа (сек), размер трека и доля ошибок.
+    telegram_chat_limit - сообщений в секунду на чат, сверх которых Telegram отвечает 429
+    """
+    yandex_latency: float = 0.05
+    cdn_latency: float = 0.05
+    telegram_latency: float = 0.05
+    payload_size: int = 5 * 1024 * 1024
+    duration: int = 180
+    yandex_error_rate: float = 0.0
+    cdn_error_rate: float = 0.0
+    telegram_error_rate: float = 0.0
+    telegram_chat_limit: float = 0.0
+    seed: int = None
+
+
+def _fail(rate: float) -> bool:
+    return rate > 0 and random.random() < rate
+
+
+def yandex_app(config: StubConfig, cdn_host: str) -> web.Application:
+    """Метаданные треков, информация для скачивания и XML с прямой ссылкой"""
+    routes = web.RouteTableDef()
+
+    @web.middleware
+    async def emulate(request, handler):
+        await asyncio.sleep(config.yandex_latency)
+        if _fail(config.yandex_error_rate):
+            return web.json_response(
+                {"error": {"name": "internal-error", "message": "stub error"}}, status=500
+            )
+        return await handler(request)
+
+    def track(track_id: str) -> dict:
+        return {
+            "id": track_id,
+            "realId": track_id,
+            "title": f"Track {track_id}",
+            "available": True,
+            "durationMs": config.duration * 1000,
+            "artists": [{"id": 1, "name": "Bench Artist"}],
+            "albums": [{"id": 1, "title": "Bench Album"}],
+        }
+
+    @routes.get("/account/status")
+    async def account_status(request):
+        return web.json_response({"result": {
+            "account": {"now": datetime.now(timezone.utc).isoformat(), "serviceAvailable": True, "uid": 1},
+            "permissions": {"until": "2100-01-01T00:00:00+00:00", "values": [], "default": []},
+        }})
+
+    @routes.post("/tracks")
+    async def tracks(request):
+        form = await request.post()
+        ids = [track_id.split(":")[0] for track_id in form.get("track-ids", "").split(",") if track_id]
+        return web.json_response({"result": [track(track_id) for track_id in ids]})
+
+    @routes.get("/tracks/{track_id}/download-info")
+    async def download_info(request):
+        track_id = request.match_info["track_id"]
+        return web.json_response({"result": [{
+            "codec": "mp3",
+            "bitrateInKbps": 320,
+            "gain": False,
+            "preview": False,
+            "direct": False,
+            "downloadInfoUrl": f"{request.scheme}://{request.host}/download-info/{track_id}.xml",
+        }]})
+
+    @routes.get("/download-info/{track_id}.xml")
+    async def download_info_xml(request):
+        track_id = request.match_info["track_id"]
+        body = (
+            "<?xml version=\"1.0\" encoding=\"utf-8\"?><download-info>"
+            f"<host>{cdn_host}</host><path>/{track_id}.mp3</path>"
+            f"<ts>{int(time.time())}</ts><region>-1</region><s>stub</s>"
+            "</download-info>"
+        )
+        return web.Response(text=body, content_type="text/xml")
+
+    app = web.Application(middlewares=[emulate])
+    app.add_routes(routes)
+    return app
+
+
+def cdn_app(config: StubConfig) -> web.Application:
+    """Раздача файла трека заданного размера (с поддержкой Range)"""
+    payload = random.randbytes(config.payload_size)
+
+    async def get_mp3(request):
+        await asyncio.sleep(config.cdn_latency)
+        if _fail(config.cdn_error_rate):
+            return web.Response(status=503)
+
+        start = 0
+        status = 200
+        headers = {"Content-Type": "audio/mpeg", "Accept-Ranges": "bytes"}
+        ranges = request.http_range
+        if ranges.start is not None and ranges.start < len(payload):
+            start = ranges.start
+            status = 206
+            headers["Content-Range"] = f"bytes {start}-{len(payload) - 1}/{len(payload)}"
+
+        response = web.StreamResponse(status=status, headers=headers)
+        response.content_length = len(payload) - start
+        await response.prepare(request)
+        view = memoryview(payload)
+        for offset in range(start, len(payload), CHUNK_SIZE):
+            await response.write(view[offset:offset + CHUNK_SIZE])
+        await response.write_eof()
+        return response
+
+    app = web.Application()
+    app.router.add_get("/get-mp3/{tail:.*}", get_mp3)
+    return app
+
+
+def telegram_app(config: StubConfig) -> web.Application:
+    """Bot API: принимает любые методы, загружаемые файлы читаются и отбрасываются"""
+    counter = {"message_id": 0}
+    chat_limits = {}
+
+    def flooded(chat_id: int) -> bool:
+        if chat_id not in chat_limits:
+            limit = config.telegram_chat_limit
+            chat_limits[chat_id] = TokenBucket(limit, burst=max(limit, 1))
+        return not chat_limits[chat_id].try_acquire()
+
+    def message(chat_id: int = 1, **fields) -> dict:
+        counter["message_id"] += 1
+        return {
+            "message_id": counter["message_id"],
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            **fields,
+        }
+
+    def audio() -> dict:
+        file_id = f"stub-audio-{counter['message_id'] + 1}"
+        return {"file_id": file_id, "file_unique_id": file_id, "duration": config.duration}
+
+    async def handle(request):
+        method = request.match_info["method"]
+        # Тело читается целиком, как это делает настоящий сервер
+        form = await request.post()
+        chat_id = int(form.get("chat_id", 1))
+        if config.telegram_chat_limit and method != "deleteMessage" and flooded(chat_id):
+            return web.json_response({
+                "ok": False, "error_code": 429,
+                "description": "Too Many Requests: retry after 1",
+                "parameters": {"retry_after": 1},
+            }, status=429)
+
+        await asyncio.sleep(config.telegram_latency)
+        if _fail(config.telegram_error_rate):
+            return web.json_response(
+                {"ok": False, "error_code": 500, "description": "Internal Server Error"}, status=500
+            )
+
+        if method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+        elif method in ("deleteMessage", "setWebhook", "deleteWebhook", "answerInlineQuery"):
+            result = True
+        elif method == "sendAudio":
+            result = message(chat_id, audio=audio())
+        elif method == "sendMediaGroup":
+            result = [message(chat_id, audio=audio())]
+        else:
+            result = message(chat_id, text="stub")
+        return web.json_response({"ok": True, "result": result})
+
+    app = web.Application(client_max_size=1024 ** 3)
+    app.router.add_post("/bot{token}/{method}", handle)
+    return app
+
+
+async def _serve(config: StubConfig, host: str, conn):
+    if config.seed is not None:
+        random.seed(config.seed)
+
+    runners = []
+
+    async def start(app: web.Application) -> str:
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, host, 0)
+        await site.start()
+        runners.append(runner)
+        port = runner.addresses[0][1]
+        return f"{host}:{port}"
+
+    cdn_host = await start(cdn_app(config))
+    yandex_host = await start(yandex_app(config, cdn_host))
+    telegram_host = await start(telegram_app(config))
+
+    conn.send({
+        "yandex": f"http://{yandex_host}",
+        "cdn": cdn_host,
+        "telegram": f"http://{telegram_host}",
+    })
+
+    # Работаем, пока родительский процесс не закроет канал
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, _wait_closed, conn)
+    for runner in runners:
+        await runner.cleanup()
+
+
+def _wait_closed(conn):
+    try:
+        conn.recv()
+    except EOFError:
+        pass
+
+
+def _run(config: StubConfig, host: str, conn):
+    asyncio.run(_serve(config, host, conn))
+
+
+class StubServers:
+    """Заглушки в дочернем процессе, адреса доступны после start()"""
+
+    def __init__(self, config: StubConfig, host: str = "127.0.0.1"):
+        self.config = config
+        self.host = host
+        self.urls = None
+        self._conn = None
+        self._process = None
+
+    def start(self) -> dict:
+        parent_conn, child_conn = multiprocessing.Pipe()
+        self._process = multiprocessing.Process(
+            target=_run, args=(self.config, self.host, child_conn), daemon=True
+        )
+        self._process.start()
+        child_conn.close()
+        self._conn = parent_conn
+        self.urls = parent_conn.recv()
+        return self.urls
+
+    def stop(self):
+        if self._conn is not None:
+            self._conn.close()
+        if self._process is not None:
+            self._process.join(timeout=5)
+            if self._process.is_alive():
+                self._process.terminate()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
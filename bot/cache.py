@@ -0,0 +1,142 @@
+import os
+import json
+import sqlite3
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Качество по умолчанию (наилучший доступный битрейт)
+DEFAULT_QUALITY = "best"
+
+# Время жизни записи по умолчанию - 30 дней
+DEFAULT_TTL = 30 * 24 * 3600
+
+
+class TrackCache:
+    """Кэш Telegram file_id уже отправленных треков (SQLite)"""
+
+    def __init__(self, path: str, ttl: int = DEFAULT_TTL):
+        self.path = path
+        self.ttl = ttl
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS tracks (
+                track_id TEXT NOT NULL,
+                quality TEXT NOT NULL,
+                file_id TEXT NOT NULL,
+                title TEXT,
+                artist TEXT,
+                duration INTEGER DEFAULT 0,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (track_id, quality)
+            )
+            """
+        )
+        self._db.commit()
+
+    async def get(self, track_id: str, quality: str = DEFAULT_QUALITY):
+        """Получение записи из кэша или None, если её нет или она устарела"""
+        row = self._db.execute(
+            "SELECT * FROM tracks WHERE track_id = ? AND quality = ?",
+            (track_id, quality)
+        ).fetchone()
+        if row is None:
+            return None
+
+        if time.time() - row["created_at"] > self.ttl:
+            await self.invalidate(track_id, quality)
+            return None
+
+        return dict(row)
+
+    async def set(self, track_id: str, quality: str, file_id: str,
+                  title: str = None, artist: str = None, duration: int = 0):
+        """Сохранение file_id трека"""
+        self._db.execute(
+            "INSERT OR REPLACE INTO tracks "
+            "(track_id, quality, file_id, title, artist, duration, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (track_id, quality, file_id, title, artist, duration, time.time())
+        )
+        self._db.commit()
+
+    async def invalidate(self, track_id: str, quality: str = DEFAULT_QUALITY):
+        """Удаление записи (например, если Telegram отклонил file_id)"""
+        self._db.execute(
+            "DELETE FROM tracks WHERE track_id = ? AND quality = ?",
+            (track_id, quality)
+        )
+        self._db.commit()
+
+    def close(self):
+        self._db.close()
+
+
+class RedisTrackCache:
+    """Кэш Telegram file_id в Redis, общий для нескольких экземпляров бота"""
+
+    def __init__(self, redis, ttl: int = DEFAULT_TTL, prefix: str = "track"):
+        self.redis = redis
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def _key(self, track_id: str, quality: str) -> str:
+        return f"{self.prefix}:{track_id}:{quality}"
+
+    async def get(self, track_id: str, quality: str = DEFAULT_QUALITY):
+        """Получение записи из кэша или None, если её нет или она устарела"""
+        value = await self.redis.get(self._key(track_id, quality))
+        if value is None:
+            return None
+        return json.loads(value)
+
+    async def set(self, track_id: str, quality: str, file_id: str,
+                  title: str = None, artist: str = None, duration: int = 0):
+        """Сохранение file_id трека"""
+        entry = {
+            "track_id": track_id,
+            "quality": quality,
+            "file_id": file_id,
+            "title": title,
+            "artist": artist,
+            "duration": duration,
+            "created_at": time.time(),
+        }
+        await self.redis.set(self._key(track_id, quality), json.dumps(entry), ex=self.ttl)
+
+    async def invalidate(self, track_id: str, quality: str = DEFAULT_QUALITY):
+        """Удаление записи (например, если Telegram отклонил file_id)"""
+        await self.redis.delete(self._key(track_id, quality))
+
+    def close(self):
+        pass
+
+
+track_cache = None
+
+def init_track_cache(path: str, ttl: int = DEFAULT_TTL, redis=None):
+    """
+    Инициализация кэша file_id.
+    Если передано подключение к Redis, кэш хранится в нём, иначе в SQLite
+    """
+    global track_cache
+    if redis is not None:
+        track_cache = RedisTrackCache(redis, ttl)
+        logger.info("Track cache initialized in Redis")
+        return
+
+    try:
+        track_cache = TrackCache(path, ttl)
+        logger.info(f"Track cache initialized at {path}")
+    except sqlite3.Error as e:
+        logger.error(f"Track cache init error: {e}")
+        track_cache = None
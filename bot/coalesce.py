@@ -0,0 +1,58 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """
+    Объединение одинаковых одновременных запросов.
+    Пока задание по ключу выполняется, остальные вызовы с тем же ключом
+    не запускают его повторно, а ждут общий результат
+    """
+
+    def __init__(self):
+        self._calls = {}
+
+    def in_flight(self, key) -> bool:
+        """Проверка, выполняется ли уже задание с таким ключом"""
+        return key in self._calls
+
+    async def do(self, key, func):
+        """
+        Выполнение func() один раз на ключ.
+        Возвращает (результат, True для вызова, который выполнил задание).
+        Если задание ведущего вызова упало с исключением (например, из-за его чата),
+        ожидающие не получают чужую ошибку, а выполняют задание заново
+        """
+        future = self._calls.get(key)
+        if future is not None:
+            logger.info(f"Joining in-flight request {key}")
+            try:
+                return await asyncio.shield(future), False
+            except Exception as e:
+                logger.warning(f"In-flight request {key} failed ({e}), retrying")
+                return await self.do(key, func)
+
+        future = asyncio.get_running_loop().create_future()
+        self._calls[key] = future
+        try:
+            result = await func()
+        except Exception as e:
+            future.set_exception(e)
+            # Исключение уже передаётся вызывающему, ожидающих может не быть
+            future.exception()
+            raise
+        except asyncio.CancelledError:
+            # Бот останавливается - ожидающие запросы тоже прерываются
+            future.cancel()
+            raise
+        else:
+            future.set_result(result)
+            return result, True
+        finally:
+            del self._calls[key]
+
+
+# Скачивания треков, объединённые по ID трека
+track_downloads = SingleFlight()
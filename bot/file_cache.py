@@ -0,0 +1,241 @@
+import os
+import time
+import asyncio
+import hashlib
+import sqlite3
+import tempfile
+import logging
+from bot.jobs import PARTIAL_MAX_AGE, PARTIAL_SUFFIX
+
+logger = logging.getLogger(__name__)
+
+# Закрепление файла истекает само, если отправивший его процесс упал
+PIN_LEASE = 3600
+
+
+class AudioFileCache:
+    """
+    Кэш скачанных треков на диске.
+    Файлы хранятся по SHA-256 содержимого, индекс (трек, битрейт) -> файл
+    лежит в SQLite рядом с ними. При превышении размера вытесняются давно
+    не использованные треки (LRU), кроме закреплённых - тех, что сейчас отправляются
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.objects_dir = os.path.join(directory, "objects")
+        self.tmp_dir = os.path.join(directory, "tmp")
+        self._pins = {}  # Путь -> id закреплений этого процесса
+        os.makedirs(self.objects_dir, exist_ok=True)
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+        self._db = sqlite3.connect(os.path.join(directory, "index.db"), check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS files (
+                track_id TEXT NOT NULL,
+                bitrate TEXT NOT NULL,
+                digest TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL,
+                PRIMARY KEY (track_id, bitrate)
+            )
+            """
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS files_lru ON files (last_access)")
+        # Закрепления хранятся в общем индексе: каталог кэша может быть общим
+        # для нескольких экземпляров бота, и вытеснять файл нельзя, пока его отправляет любой из них
+        self._db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS pins (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                digest TEXT NOT NULL,
+                until REAL NOT NULL
+            )
+            """
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS pins_digest ON pins (digest)")
+        self._db.commit()
+
+        self._cleanup_tmp()
+
+    def _object_path(self, digest: str) -> str:
+        return os.path.join(self.objects_dir, digest[:2], f"{digest}.mp3")
+
+    def _cleanup_tmp(self, max_age: int = 3600):
+        """
+        Удаление недописанных файлов после аварийного завершения.
+        Свежие файлы не трогаем: их может писать другой экземпляр бота.
+        Недокачанные файлы хранятся дольше - их загрузка продолжится после перезапуска
+        """
+        now = time.time()
+        for name in os.listdir(self.tmp_dir):
+            path = os.path.join(self.tmp_dir, name)
+            limit = PARTIAL_MAX_AGE if name.endswith(PARTIAL_SUFFIX) else max_age
+            try:
+                if now - os.path.getmtime(path) > limit:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    @property
+    def total_size(self) -> int:
+        row = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM files").fetchone()
+        return row[0]
+
+    def get(self, track_id: str, bitrate: str = None):
+        """
+        Путь к файлу трека или None.
+        Без битрейта возвращается оригинал с наибольшим битрейтом
+        """
+        found = self.lookup(track_id, bitrate)
+        return found[0] if found else None
+
+    def lookup(self, track_id: str, bitrate: str = None):
+        """Как get(), но возвращает (путь, битрейт) - битрейт нужен, чтобы выбрать оригинал"""
+        if bitrate is None:
+            # Перекодированные варианты хранятся с ключом preset:<качество>
+            rows = self._db.execute(
+                "SELECT * FROM files WHERE track_id = ? AND bitrate NOT LIKE 'preset:%' "
+                "ORDER BY CAST(bitrate AS INTEGER) DESC",
+                (track_id,)
+            ).fetchall()
+        else:
+            rows = self._db.execute(
+                "SELECT * FROM files WHERE track_id = ? AND bitrate = ?",
+                (track_id, bitrate)
+            ).fetchall()
+
+        for row in rows:
+            path = self._object_path(row["digest"])
+            if not os.path.exists(path):
+                # Файл удалён вручную - запись больше не нужна
+                self._delete_entry(row["track_id"], row["bitrate"], row["digest"])
+                continue
+
+            self._db.execute(
+                "UPDATE files SET last_access = ? WHERE track_id = ? AND bitrate = ?",
+                (time.time(), row["track_id"], row["bitrate"])
+            )
+            self._db.commit()
+            return path, row["bitrate"]
+
+        return None
+
+    def create_temp_file(self) -> str:
+        """Временный файл для записи на том же диске, что и кэш"""
+        with tempfile.NamedTemporaryFile(dir=self.tmp_dir, suffix='.part', delete=False) as tmp_file:
+            return tmp_file.name
+
+    def pin(self, path: str):
+        """Закрепление файла на время отправки: его не вытеснит ни один экземпляр бота"""
+        digest = os.path.splitext(os.path.basename(path))[0]
+        cursor = self._db.execute(
+            "INSERT INTO pins (digest, until) VALUES (?, ?)", (digest, time.time() + PIN_LEASE)
+        )
+        self._db.commit()
+        self._pins.setdefault(path, []).append(cursor.lastrowid)
+
+    def unpin(self, path: str):
+        pins = self._pins.get(path)
+        if not pins:
+            return
+        self._db.execute("DELETE FROM pins WHERE id = ?", (pins.pop(),))
+        self._db.commit()
+        if not pins:
+            del self._pins[path]
+
+    async def put(self, track_id: str, bitrate: str, temp_path: str, pin: bool = False) -> str:
+        """
+        Перенос скачанного файла в кэш.
+        Файл переименовывается атомарно, поэтому в кэше не бывает недописанных файлов.
+        С pin=True файл закрепляется до вытеснения, чтобы его можно было отправить
+        """
+        digest = await asyncio.to_thread(_file_digest, temp_path)
+        size = os.path.getsize(temp_path)
+        path = self._object_path(digest)
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(temp_path, path)
+
+        self._db.execute(
+            "INSERT OR REPLACE INTO files (track_id, bitrate, digest, size, last_access) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (track_id, bitrate, digest, size, time.time())
+        )
+        self._db.commit()
+
+        if pin:
+            self.pin(path)
+        self._evict()
+        return path
+
+    def _delete_entry(self, track_id: str, bitrate: str, digest: str):
+        self._db.execute(
+            "DELETE FROM files WHERE track_id = ? AND bitrate = ?",
+            (track_id, bitrate)
+        )
+        self._db.commit()
+
+        # Одинаковое содержимое может принадлежать нескольким записям
+        still_used = self._db.execute(
+            "SELECT 1 FROM files WHERE digest = ? LIMIT 1", (digest,)
+        ).fetchone()
+        if not still_used:
+            try:
+                os.remove(self._object_path(digest))
+            except FileNotFoundError:
+                pass
+
+    def _evict(self):
+        """Вытеснение давно не использованных файлов до лимита размера"""
+        total = self.total_size
+        if total <= self.max_bytes:
+            return
+
+        self._db.execute("DELETE FROM pins WHERE until < ?", (time.time(),))
+        self._db.commit()
+        rows = self._db.execute(
+            "SELECT * FROM files WHERE digest NOT IN (SELECT digest FROM pins) ORDER BY last_access"
+        ).fetchall()
+        evicted = 0
+        for row in rows:
+            if total <= self.max_bytes:
+                break
+            self._delete_entry(row["track_id"], row["bitrate"], row["digest"])
+            total -= row["size"]
+            evicted += 1
+
+        if evicted:
+            logger.info(f"Evicted {evicted} files from audio cache, size now {total} bytes")
+
+    def close(self):
+        self._db.close()
+
+
+def _file_digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+audio_cache = None
+
+def init_audio_cache(directory: str, max_bytes: int):
+    """Инициализация кэша файлов (при max_bytes = 0 кэш отключён)"""
+    global audio_cache
+    if max_bytes <= 0:
+        audio_cache = None
+        return
+
+    try:
+        audio_cache = AudioFileCache(directory, max_bytes)
+        logger.info(f"Audio cache initialized at {directory} ({max_bytes} bytes)")
+    except (OSError, sqlite3.Error) as e:
+        logger.error(f"Audio cache init error: {e}")
+        audio_cache = None
@@ -1,12 +1,102 @@
-from aiogram import Router, F
-from aiogram.types import Message, FSInputFile
-from aiogram.filters import CommandStart, Command
-import os
-from bot.services import download_yandex_music_track
-from bot.utils import validate_yandex_music_url, clean_url
+from aiogram import Bot, Router, F
+from aiogram.types import (
+    Message, Chat, User, InputMediaAudio, InlineQuery, InlineQueryResultCachedAudio,
+    InlineQueryResultArticle, InputTextMessageContent
+)
+from aiogram.filters import CommandStart, Command, CommandObject
+from aiogram.fsm.context import FSMContext
+from aiogram.exceptions import TelegramAPIError, TelegramBadRequest, TelegramRetryAfter
+import html
+import asyncio
+import time
+import logging
+from datetime import datetime
+from bot import cache, coalesce, jobs, scheduler, search_index
+from bot.scheduler import QueueFullError, UserQueueFullError
+from bot.cache import DEFAULT_QUALITY
+from bot.services import (
+    download_yandex_music_track, download_track_variant, fetch_collection, extract_track_id_from_url,
+    release_download, uploaded_bytes, search_tracks
+)
+from bot.http_client import StreamingInputFile
+from bot.transcode import PRESETS
+from bot.ratelimit import TokenBucket, Debouncer
+from bot.metrics import BYTES, ERRORS, REQUESTS, STAGE_LATENCY, record_cache, timed
+from bot.utils import validate_yandex_music_url, clean_url, format_duration
+
+logger = logging.getLogger(__name__)
 
 router = Router()
 
+# Параметры скачивания альбомов и плейлистов
+BATCH_CONCURRENCY = 4     # Одновременных скачиваний внутри одного альбома
+BATCH_MAX_TRACKS = 100    # Максимум треков из одной ссылки
+MEDIA_GROUP_SIZE = 10     # Ограничение Telegram на размер медиагруппы
+
+# Повторы потоковой отправки трека после ответа 429
+STREAM_UPLOAD_RETRIES = 3
+
+# Параметры inline-режима
+INLINE_RESULTS_LIMIT = 20
+INLINE_SEARCH_DELAY = 0.7    # Ожидание окончания ввода перед поиском в Яндекс.Музыке
+INLINE_SEARCH_RATE = 2       # Не больше запросов поиска в секунду на весь бот
+
+inline_debouncer = Debouncer(INLINE_SEARCH_DELAY)
+inline_search_limiter = TokenBucket(INLINE_SEARCH_RATE, burst=5)
+
+# Задачи, обрабатывающие ссылки: при остановке бота они отменяются до закрытия сессий
+active_requests = set()
+
+def build_caption(artist: str, title: str, duration: int) -> str:
+    """Формирование подписи к аудио"""
+    caption = f"🎵 {artist} - {title}"
+    if duration > 0:
+        caption += f"\n⏱ Длительность: {format_duration(duration)}"
+    return caption
+
+async def remember_track(track_id: str, file_id: str, title: str, artist: str,
+                         duration: int, quality: str = DEFAULT_QUALITY):
+    """Сохранение file_id отправленного трека в кэше и поисковом индексе"""
+    if cache.track_cache is not None:
+        await cache.track_cache.set(track_id, quality, file_id, title, artist, duration)
+    if search_index.search_index is not None and quality == DEFAULT_QUALITY:
+        search_index.search_index.add(track_id, file_id, artist, title, duration)
+
+async def forget_track(track_id: str, quality: str = DEFAULT_QUALITY):
+    """Удаление устаревшего file_id из кэша и поискового индекса"""
+    if cache.track_cache is not None:
+        await cache.track_cache.invalidate(track_id, quality)
+    if search_index.search_index is not None and quality == DEFAULT_QUALITY:
+        search_index.search_index.remove(track_id)
+
+async def send_cached_audio(message: Message, track_id: str, quality: str = DEFAULT_QUALITY) -> bool:
+    """
+    Отправка трека по сохранённому file_id.
+    Возвращает False, если трека нет в кэше или Telegram отклонил file_id
+    """
+    if cache.track_cache is None:
+        return False
+
+    cached = await cache.track_cache.get(track_id, quality)
+    record_cache("file_id", cached is not None)
+    if not cached:
+        return False
+
+    try:
+        await message.answer_audio(
+            audio=cached["file_id"],
+            title=cached["title"],
+            performer=cached["artist"],
+            caption=build_caption(cached["artist"], cached["title"], cached["duration"])
+        )
+    except TelegramBadRequest as e:
+        logger.warning(f"Cached file_id rejected for track {track_id}: {e}")
+        await forget_track(track_id, quality)
+        return False
+
+    logger.info(f"Track {track_id} sent from cache")
+    return True
+
 @router.message(CommandStart())
 async def cmd_start(message: Message):
     await message.answer(
@@ -15,14 +105,82 @@ async def cmd_start(message: Message):
         "📋 Поддерживаемые форматы:\n"
         "• https://music.yandex.ru/album/1234567/track/7654321\n"
         "• https://music.yandex.ru/track/1234567\n"
-        "• https://music.yandex.com/album/1234567/track/7654321\n\n"
+        "• https://music.yandex.com/album/1234567/track/7654321\n"
+        "• https://music.yandex.ru/album/1234567 (весь альбом)\n"
+        "• https://music.yandex.ru/users/username/playlists/1000 (плейлист)\n\n"
         "Ссылки могут содержать параметры (например, utm_source), я их проигнорирую.\n\n"
+        "🎚 Качество: /quality 128, /quality 192, /quality 320 или /quality best\n\n"
         "⚠️ Используйте бота только для скачивания музыки, на которую у вас есть права!"
     )
 
+@router.message(Command("quality"))
+async def cmd_quality(message: Message, command: CommandObject, state: FSMContext):
+    """Выбор качества скачиваемых треков"""
+    choices = ", ".join([*PRESETS, DEFAULT_QUALITY])
+    quality = (command.args or "").strip().lower()
+    
+    if not quality:
+        current = (await state.get_data()).get("quality", DEFAULT_QUALITY)
+        await message.answer(f"🎚 Текущее качество: {current}\nДоступно: {choices}")
+        return
+    
+    if quality not in PRESETS and quality != DEFAULT_QUALITY:
+        await message.answer(f"❌ Неизвестное качество. Доступно: {choices}")
+        return
+    
+    await state.update_data(quality=quality)
+    await message.answer(f"✅ Качество установлено: {quality}")
+
+@router.inline_query()
+async def handle_inline_query(inline_query: InlineQuery):
+    """
+    Inline-поиск: сначала по индексу уже отправленных треков (их можно
+    отправить сразу по file_id), при промахе - поиск в Яндекс.Музыке
+    """
+    query = inline_query.query.strip()
+    if not query:
+        await inline_query.answer([], cache_time=5)
+        return
+    
+    with timed("inline"):
+        found = search_index.search_index.search(query, INLINE_RESULTS_LIMIT) if search_index.search_index else []
+    record_cache("inline_index", bool(found))
+    
+    if found:
+        results = [
+            InlineQueryResultCachedAudio(
+                id=track["track_id"],
+                audio_file_id=track["file_id"],
+                caption=build_caption(track["artist"], track["title"], track["duration"] or 0)
+            )
+            for track in found
+        ]
+        await inline_query.answer(results, cache_time=300, is_personal=False)
+        return
+    
+    # Поиск в Яндекс.Музыке только после паузы в наборе и в пределах общего лимита
+    if not await inline_debouncer.wait(inline_query.from_user.id):
+        return
+    if not inline_search_limiter.try_acquire():
+        await inline_query.answer([], cache_time=1, is_personal=True)
+        return
+    
+    tracks = await search_tracks(query, INLINE_RESULTS_LIMIT)
+    results = [
+        InlineQueryResultArticle(
+            id=track["track_id"],
+            title=track["title"],
+            description=track["artist"],
+            input_message_content=InputTextMessageContent(message_text=track["url"])
+        )
+        for track in tracks
+    ]
+    await inline_query.answer(results, cache_time=60, is_personal=False)
+
 @router.message(F.text)
-async def handle_url(message: Message):
+async def handle_url(message: Message, state: FSMContext):
     url = message.text.strip()
+    quality = (await state.get_data()).get("quality", DEFAULT_QUALITY)
     
     # Очищаем URL от параметров отслеживания
     cleaned_url = clean_url(url)
@@ -39,48 +197,442 @@ async def handle_url(message: Message):
     
     # Отправка статуса обработки
     status_msg = await message.answer("⏳ Обрабатываю ссылку...")
+    track_id = extract_track_id_from_url(cleaned_url)
+    
+    # Задание записывается в журнал, чтобы продолжить его после перезапуска бота
+    job_id = None
+    if jobs.job_store is not None:
+        job_id = jobs.job_store.create(
+            message.chat.id, message.chat.type, message.from_user.id, message.message_id,
+            status_msg.message_id, cleaned_url, track_id, quality
+        )
+    
+    await process_url(message, status_msg, cleaned_url, quality, job_id)
+
+async def process_url(message: Message, status_msg: Message, cleaned_url: str,
+                      quality: str = DEFAULT_QUALITY, job_id: int = None, job: dict = None):
+    """
+    Обработка проверенной ссылки: скачивание и отправка трека или альбома.
+    job - запись журнала, если задание продолжается после перезапуска
+    """
+    started = time.monotonic()
+    track_id = extract_track_id_from_url(cleaned_url)
+    kind = "track" if track_id else "collection"
+    # При остановке бота задание остаётся в журнале, в остальных случаях пользователь получил ответ
+    finished = True
+    task = asyncio.current_task()
+    active_requests.add(task)
     
     try:
-        # Скачивание трека
-        result = await download_yandex_music_track(cleaned_url)
+        # Ссылка на альбом или плейлист
+        if not track_id:
+            result = await run_scheduled(
+                message, status_msg,
+                lambda: deliver_collection(message, status_msg, cleaned_url, quality, job_id, job)
+            )
+            if not result["success"]:
+                REQUESTS.labels(kind, "error").inc()
+                await report_error(status_msg, result["error"])
+            else:
+                REQUESTS.labels(kind, "sent").inc()
+            return
+        
+        # Трек уже отправлялся - повторно используем file_id без скачивания
+        if await send_cached_audio(message, track_id, quality):
+            REQUESTS.labels(kind, "cached").inc()
+            await status_msg.delete()
+            return
+        
+        async def fetch():
+            return await run_scheduled(
+                message, status_msg,
+                lambda: deliver_track(message, status_msg, cleaned_url, track_id, quality, job_id)
+            )
+        
+        # Одинаковые одновременные запросы скачивают трек один раз
+        key = f"{track_id}:{quality}"
+        if coalesce.track_downloads.in_flight(key):
+            await status_msg.edit_text("⏳ Этот трек уже скачивается, подождите...")
+        result, leader = await coalesce.track_downloads.do(key, fetch)
         
         if result["success"]:
-            await status_msg.edit_text("✅ Трек скачан! Отправляю...")
-            
-            # Отправка аудиофайла
-            audio_file = FSInputFile(result["file_path"])
+            if not leader:
+                await message.answer_audio(
+                    audio=result["file_id"],
+                    title=result["title"],
+                    performer=result["artist"],
+                    caption=build_caption(result["artist"], result["title"], result["duration"])
+                )
+            REQUESTS.labels(kind, "sent" if leader else "coalesced").inc()
+            await status_msg.delete()
+        else:
+            REQUESTS.labels(kind, "error").inc()
+            await report_error(status_msg, result["error"])
+        
+    except UserQueueFullError:
+        REQUESTS.labels(kind, "rejected").inc()
+        await status_msg.edit_text("❌ У вас уже много ссылок в очереди. Дождитесь их обработки.")
+    except QueueFullError:
+        REQUESTS.labels(kind, "rejected").inc()
+        await status_msg.edit_text("❌ Сейчас слишком много запросов. Попробуйте через пару минут.")
+    except asyncio.CancelledError:
+        finished = False
+        raise
+    except Exception as e:
+        REQUESTS.labels(kind, "error").inc()
+        ERRORS.labels("telegram" if isinstance(e, TelegramAPIError) else "unexpected").inc()
+        await status_msg.edit_text(f"❌ Произошла неожиданная ошибка: {str(e)}")
+    finally:
+        active_requests.discard(task)
+        if finished and job_id is not None:
+            jobs.job_store.finish(job_id)
+        STAGE_LATENCY.labels("request").observe(time.monotonic() - started)
+
+async def cancel_requests(timeout: float = 10):
+    """
+    Отмена обрабатываемых ссылок при остановке бота, пока сессии ещё открыты:
+    прерванные задания остаются в журнале и продолжаются после перезапуска
+    """
+    if scheduler.job_scheduler is not None:
+        await scheduler.job_scheduler.shutdown(timeout)
+    tasks = set(active_requests)
+    for task in tasks:
+        task.cancel()
+    if tasks:
+        await asyncio.wait(tasks, timeout=timeout)
+
+def update_job(job_id: int, stage: str, progress: int = None, sent: int = None):
+    """Отметка этапа задания в журнале"""
+    if job_id is not None and jobs.job_store is not None:
+        jobs.job_store.update(job_id, stage, progress, sent)
+
+async def run_scheduled(message: Message, status_msg: Message, func) -> dict:
+    """Выполнение func() через очередь заданий"""
+    if scheduler.job_scheduler is None:
+        return await func()
+    
+    # Ожидание своей очереди с отображением позиции в статусе
+    state = {"queued": False, "started": False}
+    submitted = time.monotonic()
+    
+    async def on_position(position: int):
+        if state["started"]:
+            return
+        state["queued"] = True
+        await status_msg.edit_text(f"⏳ Ссылка в очереди, позиция: {position}")
+    
+    async def job():
+        state["started"] = True
+        STAGE_LATENCY.labels("queue_wait").observe(time.monotonic() - submitted)
+        if state["queued"]:
+            await update_status(status_msg, "⏳ Обрабатываю ссылку...")
+        return await func()
+    
+    return await scheduler.job_scheduler.run(message.from_user.id, job, on_position)
+
+async def deliver_track(message: Message, status_msg: Message, url: str, track_id: str,
+                        quality: str = DEFAULT_QUALITY, job_id: int = None) -> dict:
+    """
+    Скачивание трека и отправка его пользователю.
+    При успехе в результат добавляется file_id отправленного аудио
+    """
+    # Скачивание трека
+    update_job(job_id, "downloading")
+    result = await download_yandex_music_track(url, quality)
+    if not result["success"]:
+        return result
+    
+    update_job(job_id, "uploading")
+    # Статус относится только к чату этого запроса: его ошибка не должна
+    # прерывать загрузку, результат которой ждут объединённые запросы
+    await update_status(status_msg, "✅ Трек скачан! Отправляю...")
+    
+    try:
+        # Создаем подпись
+        caption = build_caption(result["artist"], result["title"], result["duration"])
+        
+        # Отправка аудиофайла (с диска или потоком из CDN)
+        with timed("upload"):
+            for attempt in range(STREAM_UPLOAD_RETRIES + 1):
+                try:
+                    sent = await message.answer_audio(
+                        audio=result["audio"],
+                        title=result["title"],
+                        performer=result["artist"],
+                        caption=caption
+                    )
+                    break
+                except TelegramRetryAfter as e:
+                    # Поток из CDN прочитан первой попыткой, и повторить запрос нельзя:
+                    # после паузы трек скачивается заново
+                    if not isinstance(result["audio"], StreamingInputFile) or attempt >= STREAM_UPLOAD_RETRIES:
+                        raise
+                    logger.warning(f"Flood control on streamed upload of {track_id}, retry after {e.retry_after}s")
+                    release_download(result)
+                    await asyncio.sleep(e.retry_after)
+                    result = await download_yandex_music_track(url, quality)
+                    if not result["success"]:
+                        return result
+        BYTES.labels("upload").inc(uploaded_bytes(result))
+    finally:
+        # Удаление временного файла или закрытие потока
+        release_download(result)
+    
+    result["file_id"] = sent.audio.file_id
+    update_job(job_id, "sent")
+    
+    # Запоминаем file_id для повторных запросов; трек уже отправлен,
+    # поэтому ошибка кэша не мешает вернуть file_id ожидающим запросам
+    try:
+        await remember_track(
+            track_id, result["file_id"], result["title"], result["artist"], result["duration"], quality
+        )
+    except Exception as e:
+        logger.warning(f"Failed to remember track {track_id}: {e}")
+    
+    return result
+
+async def deliver_collection(message: Message, status_msg: Message, url: str,
+                             quality: str = DEFAULT_QUALITY, job_id: int = None, job: dict = None) -> dict:
+    """
+    Скачивание альбома или плейлиста.
+    Треки скачиваются параллельно и отправляются медиагруппами по мере готовности.
+    Продолжаемое задание (job) пропускает уже отправленные медиагруппы
+    """
+    update_job(job_id, "downloading")
+    collection = await fetch_collection(url, BATCH_MAX_TRACKS)
+    if not collection["success"]:
+        return collection
+    
+    tracks = collection["tracks"]
+    total = len(tracks)
+    capped = collection.get("capped", 0)
+    # Сообщения бота размечены HTML, а название задаёт автор плейлиста
+    title = html.escape(collection["title"])
+    if capped:
+        await update_status(status_msg, f"⏳ {title}: скачиваю первые {total} из {total + capped} треков...")
+    else:
+        await update_status(status_msg, f"⏳ {title}: скачиваю {total} треков...")
+    
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+    
+    async def prepare(track) -> dict:
+        track_id = str(track.id)
+        if cache.track_cache is not None:
+            cached = await cache.track_cache.get(track_id, quality)
+            record_cache("file_id", cached is not None)
+            if cached:
+                return {"success": True, "track_id": track_id, "cached": True, **cached}
+        # Треки группы ждут отправки вместе, поэтому держать открытыми
+        # соединения с CDN нельзя - альбомы всегда скачиваются на диск
+        async with semaphore:
+            return await download_track_variant(track, quality, stream=False)
+    
+    # Скачивание идёт не дальше чем на одну группу вперёд от отправки,
+    # чтобы не забивать диск файлами, которые ещё нельзя отправить
+    groups = [tracks[i:i + MEDIA_GROUP_SIZE] for i in range(0, total, MEDIA_GROUP_SIZE)]
+    pending = []
+    first_group = job["progress"] if job else 0
+    sent_count = job["sent"] if job else 0
+    
+    def schedule(index: int):
+        if index < len(groups):
+            pending.append([asyncio.create_task(prepare(track)) for track in groups[index]])
+    
+    schedule(first_group)
+    try:
+        for index in range(first_group, len(groups)):
+            schedule(index + 1)
+            # Группа остаётся в pending до конца ожидания, чтобы при отмене
+            # её уже скачанные файлы удалил блок finally
+            results = await asyncio.gather(*pending[0], return_exceptions=True)
+            pending.pop(0)
+            ready = []
+            for result in results:
+                if isinstance(result, BaseException):
+                    logger.error(f"Collection track failed: {result}")
+                elif not result["success"]:
+                    logger.warning(f"Collection track skipped: {result['error']}")
+                else:
+                    ready.append(result)
             
-            # Создаем подпись
-            caption = f"🎵 {result['artist']} - {result['title']}"
-            if result['duration'] > 0:
-                from bot.utils import format_duration
-                caption += f"\n⏱ Длительность: {format_duration(result['duration'])}"
+            update_job(job_id, "uploading")
+            try:
+                sent_count += await send_media_group(message, ready, quality)
+            finally:
+                remove_temp_files(ready)
+            update_job(job_id, "downloading", progress=index + 1, sent=sent_count)
             
-            await message.answer_audio(
-                audio=audio_file,
-                title=result["title"],
-                performer=result["artist"],
-                caption=caption
+            await update_status(status_msg, f"⏳ {title}: отправлено {sent_count} из {total}...")
+    finally:
+        # При ошибке отменяем оставшиеся скачивания и удаляем уже скачанное
+        for tasks in pending:
+            for task in tasks:
+                task.cancel()
+            for task in tasks:
+                try:
+                    result = await task
+                except (asyncio.CancelledError, Exception):
+                    continue
+                if result["success"]:
+                    remove_temp_files([result])
+    
+    update_job(job_id, "sent")
+    if sent_count == total and not capped:
+        await update_status(status_msg, None)
+    else:
+        text = f"✅ {title}: отправлено {sent_count} из {total} треков."
+        if sent_count < total:
+            text += " Остальные треки недоступны."
+        if capped:
+            text += (
+                f"\nИз одной ссылки отправляется не больше {BATCH_MAX_TRACKS} треков, "
+                f"не отправлено сверх ограничения: {capped}."
             )
-            
-            # Удаление временного файла
+        await update_status(status_msg, text)
+    return {"success": True}
+
+async def send_media_group(message: Message, results: list, quality: str = DEFAULT_QUALITY) -> int:
+    """Отправка группы треков одним сообщением и сохранение их file_id"""
+    if not results:
+        return 0
+    
+    media = [
+        InputMediaAudio(
+            media=result["file_id"] if result.get("cached") else result["audio"],
+            title=result["title"],
+            performer=result["artist"],
+            duration=result["duration"] or None,
+            caption=build_caption(result["artist"], result["title"], result["duration"])
+        )
+        for result in results
+    ]
+    
+    # Медиагруппа должна содержать от 2 до 10 элементов
+    with timed("upload"):
+        if len(media) == 1:
+            sent = await send_media_separately(message, results, media, quality)
+        else:
             try:
-                os.remove(result["file_path"])
-            except:
-                pass
-            
+                sent = await message.answer_media_group(media)
+            except TelegramBadRequest as e:
+                # Скорее всего, Telegram отклонил один из сохранённых file_id
+                logger.warning(f"Media group rejected, sending tracks one by one: {e}")
+                sent = await send_media_separately(message, results, media, quality)
+    
+    for result in results:
+        if not result.get("cached"):
+            BYTES.labels("upload").inc(uploaded_bytes(result))
+    
+    for result, sent_message in zip(results, sent):
+        if not result.get("cached") and sent_message is not None and sent_message.audio:
+            await remember_track(
+                result["track_id"], sent_message.audio.file_id,
+                result["title"], result["artist"], result["duration"], quality
+            )
+    
+    return len([sent_message for sent_message in sent if sent_message is not None])
+
+async def send_media_separately(message: Message, results: list, media: list,
+                                quality: str = DEFAULT_QUALITY) -> list:
+    """Отправка треков по одному, устаревшие file_id удаляются из кэша"""
+    sent = []
+    for result, item in zip(results, media):
+        try:
+            sent.append(await message.answer_audio(
+                audio=item.media,
+                title=item.title,
+                performer=item.performer,
+                caption=item.caption
+            ))
+        except TelegramBadRequest as e:
+            if not result.get("cached"):
+                raise
+            logger.warning(f"Cached file_id rejected for track {result['track_id']}: {e}")
+            await forget_track(result["track_id"], quality)
+            sent.append(None)
+    return sent
+
+def remove_temp_files(results: list):
+    """Удаление временных файлов скачанных треков"""
+    for result in results:
+        if not result.get("cached"):
+            release_download(result)
+
+async def report_error(status_msg: Message, error_msg: str):
+    """Вывод ошибки в статусное сообщение с подсказкой"""
+    advice = ""
+    
+    if "не найден" in error_msg.lower():
+        advice = "\n\n💡 Проверьте, что трек доступен в вашем регионе и вы правильно скопировали ссылку."
+    elif "токен" in error_msg.lower():
+        advice = "\n\n💡 Попробуйте обновить токен Яндекс.Музыки в настройках бота."
+    
+    await status_msg.edit_text(f"❌ {error_msg}{advice}")
+
+async def resume_job(bot: Bot, job: dict):
+    """Продолжение задания, прерванного перезапуском бота"""
+    chat = Chat(id=job["chat_id"], type=job["chat_type"])
+    message = Message(
+        message_id=job["message_id"],
+        date=datetime.now(),
+        chat=chat,
+        from_user=User(id=job["user_id"], is_bot=False, first_name=""),
+        text=job["url"],
+    ).as_(bot)
+    status_msg = Message(
+        message_id=job["status_message_id"], date=datetime.now(), chat=chat
+    ).as_(bot)
+    
+    # Трек уже отправлен - осталось убрать статус
+    if job["stage"] == "sent":
+        jobs.job_store.finish(job["id"])
+        await update_status(status_msg, None)
+        return
+    
+    if job["attempts"] > jobs.MAX_ATTEMPTS or time.time() - job["created_at"] > jobs.MAX_JOB_AGE:
+        jobs.job_store.finish(job["id"])
+        REQUESTS.labels("track" if job["track_id"] else "collection", "error").inc()
+        await update_status(status_msg, "❌ Не удалось обработать ссылку. Отправьте её ещё раз.")
+        return
+    
+    await update_status(status_msg, "⏳ Продолжаю после перезапуска бота...")
+    await process_url(message, status_msg, job["url"], job["quality"], job["id"], job)
+
+async def update_status(status_msg: Message, text: str = None):
+    """Изменение (или удаление при text=None) статуса, который мог быть уже удалён"""
+    try:
+        if text is None:
             await status_msg.delete()
-            
         else:
-            error_msg = result['error']
-            advice = ""
-            
-            if "не найден" in error_msg.lower():
-                advice = "\n\n💡 Проверьте, что трек доступен в вашем регионе и вы правильно скопировали ссылку."
-            elif "токен" in error_msg.lower():
-                advice = "\n\n💡 Попробуйте обновить токен Яндекс.Музыки в настройках бота."
-            
-            await status_msg.edit_text(f"❌ {error_msg}{advice}")
-            
-    except Exception as e:
-        await status_msg.edit_text(f"❌ Произошла неожиданная ошибка: {str(e)}")
\ No newline at end of file
+            await status_msg.edit_text(text)
+    except TelegramAPIError as e:
+        logger.warning(f"Failed to update status message {status_msg.message_id}: {e}")
+
+async def recover_jobs(bot: Bot):
+    """
+    Продолжение прерванных заданий при запуске, затем периодическая отметка
+    о работе и подбор заданий остановившихся экземпляров бота
+    """
+    if jobs.job_store is None:
+        return
+    
+    tasks = set()
+    include_own = True
+    while True:
+        try:
+            jobs.job_store.heartbeat()
+            claimed = jobs.job_store.claim_unfinished(include_own)
+        except Exception as e:
+            logger.error(f"Job recovery error: {e}")
+            claimed = []
+        include_own = False
+        
+        if claimed:
+            logger.info(f"Resuming {len(claimed)} unfinished jobs")
+        for job in claimed:
+            task = asyncio.create_task(resume_job(bot, job))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        
+        await asyncio.sleep(jobs.HEARTBEAT_INTERVAL)
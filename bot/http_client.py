@@ -0,0 +1,225 @@
+import os
+import re
+import asyncio
+import random
+import logging
+import aiohttp
+from aiogram.types import InputFile
+from bot.metrics import BYTES
+
+logger = logging.getLogger(__name__)
+
+USER_AGENT = (
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 '
+    '(KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+)
+
+# Коды ответа, при которых имеет смысл повторить запрос
+RETRY_STATUSES = {408, 429, 500, 502, 503, 504}
+
+# Настройки по умолчанию
+config = {
+    "pool_limit": 100,           # Всего соединений в пуле
+    "pool_limit_per_host": 10,   # Соединений на один хост CDN
+    "keepalive_timeout": 60,     # Сколько держать простаивающее соединение
+    "chunk_size": 64 * 1024,     # Размер читаемого блока
+    "retries": 3,                # Количество повторов при временных ошибках
+    "backoff": 0.5,              # Базовая задержка между повторами, сек
+    "connect_timeout": 10,
+    "read_timeout": 30,
+    "stream_threshold": None,    # Размер, начиная с которого файл не пишется на диск
+}
+
+_session = None
+
+def init_http_session(**options):
+    """Создание общего HTTP-клиента с пулом соединений"""
+    global _session
+    config.update({key: value for key, value in options.items() if value is not None})
+
+    connector = aiohttp.TCPConnector(
+        limit=config["pool_limit"],
+        limit_per_host=config["pool_limit_per_host"],
+        keepalive_timeout=config["keepalive_timeout"],
+        ttl_dns_cache=300,
+    )
+    timeout = aiohttp.ClientTimeout(
+        total=None,
+        sock_connect=config["connect_timeout"],
+        sock_read=config["read_timeout"],
+    )
+    _session = aiohttp.ClientSession(
+        connector=connector,
+        timeout=timeout,
+        headers={"User-Agent": USER_AGENT},
+    )
+    logger.info(
+        f"HTTP session initialized (pool {config['pool_limit']}, "
+        f"per host {config['pool_limit_per_host']})"
+    )
+    return _session
+
+def get_session() -> aiohttp.ClientSession:
+    """Общий HTTP-клиент (создаётся при первом обращении)"""
+    if _session is None or _session.closed:
+        return init_http_session()
+    return _session
+
+async def close_http_session():
+    """Закрытие HTTP-клиента и всех соединений пула"""
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+def is_transient_error(error: Exception) -> bool:
+    """Проверка, что ошибка временная и запрос можно повторить"""
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status in RETRY_STATUSES
+    return isinstance(error, (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError))
+
+async def backoff_delay(attempt: int) -> None:
+    """Экспоненциальная задержка перед повтором с небольшим разбросом"""
+    delay = config["backoff"] * (2 ** attempt)
+    await asyncio.sleep(delay + random.uniform(0, delay / 2))
+
+async def download_file(url: str, filepath: str, chunk_size: int = None, resume: bool = False) -> bool:
+    """
+    Асинхронная загрузка файла с повторами при временных ошибках.
+    С resume=True уже скачанное начало файла не загружается заново:
+    запрашивается только остаток (Range), в том числе при повторах
+    """
+    chunk_size = chunk_size or config["chunk_size"]
+    session = get_session()
+
+    for attempt in range(config["retries"] + 1):
+        try:
+            offset = os.path.getsize(filepath) if resume and os.path.exists(filepath) else 0
+            headers = {"Range": f"bytes={offset}-"} if offset else None
+
+            async with session.get(url, headers=headers) as response:
+                if offset and response.status == 416:
+                    # Файл уже скачан целиком или на сервере изменился
+                    total = _content_range_total(response.headers.get("Content-Range"))
+                    if total == offset:
+                        return True
+                    os.remove(filepath)
+                    raise aiohttp.ClientPayloadError("Partial file does not match remote file")
+                response.raise_for_status()
+
+                # Сервер без поддержки Range присылает файл целиком
+                append = bool(offset) and response.status == 206 and _content_range_start(
+                    response.headers.get("Content-Range")) == offset
+                if append:
+                    logger.info(f"Resuming download of {filepath} from {offset} bytes")
+                with open(filepath, 'ab' if append else 'wb') as f:
+                    async for chunk in response.content.iter_chunked(chunk_size):
+                        f.write(chunk)
+                        BYTES.labels("download").inc(len(chunk))
+            return True
+
+        except Exception as e:
+            if attempt < config["retries"] and is_transient_error(e):
+                logger.warning(f"Download attempt {attempt + 1} failed: {e}, retrying")
+                await backoff_delay(attempt)
+                continue
+            logger.error(f"Download error: {e}")
+            return False
+
+    return False
+
+def _content_range_start(value: str):
+    """Начало диапазона из заголовка Content-Range: bytes 100-199/200"""
+    match = re.match(r"bytes (\d+)-", value or "")
+    return int(match.group(1)) if match else None
+
+def _content_range_total(value: str):
+    """Полный размер из заголовка Content-Range: bytes */200"""
+    match = re.match(r"bytes [^/]+/(\d+)", value or "")
+    return int(match.group(1)) if match else None
+
+async def open_stream(url: str):
+    """Открытие HTTP-ответа для потокового чтения с повторами при временных ошибках"""
+    session = get_session()
+
+    for attempt in range(config["retries"] + 1):
+        try:
+            return await session.get(url, raise_for_status=True)
+
+        except Exception as e:
+            if attempt < config["retries"] and is_transient_error(e):
+                logger.warning(f"Stream open attempt {attempt + 1} failed: {e}, retrying")
+                await backoff_delay(attempt)
+                continue
+            logger.error(f"Stream open error: {e}")
+            return None
+
+    return None
+
+def streaming_enabled() -> bool:
+    """Включена ли потоковая отправка файлов"""
+    return config["stream_threshold"] is not None
+
+def should_stream(content_length) -> bool:
+    """Нужно ли отправлять файл в Telegram напрямую, минуя диск"""
+    threshold = config["stream_threshold"]
+    if threshold is None:
+        return False
+    return content_length is None or content_length >= threshold
+
+async def save_stream(response: aiohttp.ClientResponse, filepath: str, chunk_size: int = None) -> bool:
+    """Запись уже открытого HTTP-ответа в файл"""
+    chunk_size = chunk_size or config["chunk_size"]
+    try:
+        with open(filepath, 'wb') as f:
+            async for chunk in response.content.iter_chunked(chunk_size):
+                f.write(chunk)
+                BYTES.labels("download").inc(len(chunk))
+        return True
+    except Exception as e:
+        logger.error(f"Download error: {e}")
+        return False
+    finally:
+        response.release()
+
+
+class StreamingInputFile(InputFile):
+    """
+    Файл для отправки в Telegram, который читается прямо из ответа CDN.
+    Тело ответа передаётся в multipart-запрос по частям и не пишется на диск
+    """
+
+    def __init__(self, response: aiohttp.ClientResponse, filename: str, chunk_size: int = None):
+        super().__init__(filename=filename, chunk_size=chunk_size or config["chunk_size"])
+        self.response = response
+        self.content_length = response.content_length
+        self.bytes_read = 0
+        self._head = b""
+
+    async def prefetch(self, size: int) -> int:
+        """Чтение начала файла заранее, чтобы проверить размер до отправки"""
+        while len(self._head) < size:
+            chunk = await self.response.content.read(size - len(self._head))
+            if not chunk:
+                break
+            self._head += chunk
+        return len(self._head)
+
+    async def read(self, bot):
+        try:
+            if self._head:
+                head, self._head = self._head, b""
+                self.bytes_read += len(head)
+                BYTES.labels("download").inc(len(head))
+                yield head
+
+            async for chunk in self.response.content.iter_chunked(self.chunk_size):
+                self.bytes_read += len(chunk)
+                BYTES.labels("download").inc(len(chunk))
+                yield chunk
+        finally:
+            self.close()
+
+    def close(self):
+        """Освобождение соединения с CDN"""
+        self.response.release()
@@ -0,0 +1,187 @@
+import os
+import time
+import socket
+import sqlite3
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Этапы задания: queued -> downloading -> uploading -> sent.
+# У альбома progress - число отправленных медиагрупп, sent - отправленных треков
+STAGES = ("queued", "downloading", "uploading", "sent")
+
+# Задание, которое не удалось завершить за столько перезапусков, отменяется
+MAX_ATTEMPTS = 3
+
+# Слишком старые задания после перезапуска не продолжаются
+MAX_JOB_AGE = 24 * 3600
+
+# Экземпляр, не отмечавшийся дольше этого, считается аварийно остановленным,
+# и его задания забирают другие экземпляры (или он сам после перезапуска)
+HEARTBEAT_INTERVAL = 30
+ORPHAN_TIMEOUT = 120
+
+# Недокачанные файлы старше этого удаляются при запуске
+PARTIAL_MAX_AGE = 24 * 3600
+PARTIAL_SUFFIX = ".partial"
+
+
+class JobStore:
+    """
+    Журнал заданий в SQLite: запись появляется при получении ссылки
+    и удаляется после ответа пользователю. Оставшиеся записи - задания,
+    прерванные перезапуском, их продолжают при следующем запуске
+    """
+
+    def __init__(self, path: str, partial_dir: str, owner: str = None):
+        self.path = path
+        self.partial_dir = partial_dir
+        self.owner = owner or f"{socket.gethostname()}-{os.getpid()}"
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        os.makedirs(partial_dir, exist_ok=True)
+
+        # Журнал может быть общим для нескольких экземпляров бота
+        self._db = sqlite3.connect(path, timeout=10, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                owner TEXT NOT NULL,
+                chat_id INTEGER NOT NULL,
+                chat_type TEXT NOT NULL,
+                user_id INTEGER NOT NULL,
+                message_id INTEGER NOT NULL,
+                status_message_id INTEGER NOT NULL,
+                url TEXT NOT NULL,
+                track_id TEXT,
+                quality TEXT NOT NULL,
+                stage TEXT NOT NULL,
+                progress INTEGER NOT NULL DEFAULT 0,
+                sent INTEGER NOT NULL DEFAULT 0,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS instances (owner TEXT PRIMARY KEY, seen_at REAL NOT NULL)"
+        )
+        self._db.commit()
+
+        self.heartbeat()
+        self._cleanup_partial()
+
+    def _cleanup_partial(self):
+        """Удаление давно брошенных недокачанных файлов"""
+        now = time.time()
+        for name in os.listdir(self.partial_dir):
+            path = os.path.join(self.partial_dir, name)
+            try:
+                if now - os.path.getmtime(path) > PARTIAL_MAX_AGE:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def create(self, chat_id: int, chat_type: str, user_id: int, message_id: int,
+               status_message_id: int, url: str, track_id: str, quality: str) -> int:
+        """Запись нового задания, возвращает его id"""
+        now = time.time()
+        cursor = self._db.execute(
+            "INSERT INTO jobs (owner, chat_id, chat_type, user_id, message_id, status_message_id, "
+            "url, track_id, quality, stage, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 'queued', ?, ?)",
+            (self.owner, chat_id, chat_type, user_id, message_id, status_message_id,
+             url, track_id, quality, now, now)
+        )
+        self._db.commit()
+        return cursor.lastrowid
+
+    def update(self, job_id: int, stage: str, progress: int = None, sent: int = None):
+        """Переход задания на следующий этап"""
+        self._db.execute(
+            "UPDATE jobs SET stage = ?, progress = COALESCE(?, progress), "
+            "sent = COALESCE(?, sent), updated_at = ? WHERE id = ?",
+            (stage, progress, sent, time.time(), job_id)
+        )
+        self._db.commit()
+
+    def finish(self, job_id: int):
+        """Задание завершено (успешно или с ошибкой, о которой сообщили пользователю)"""
+        self._db.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+        self._db.commit()
+
+    def heartbeat(self):
+        """Отметка, что этот экземпляр бота работает"""
+        self._db.execute(
+            "INSERT OR REPLACE INTO instances (owner, seen_at) VALUES (?, ?)",
+            (self.owner, time.time())
+        )
+        self._db.commit()
+
+    def retire(self):
+        """
+        Остановка экземпляра: его незавершённые задания сразу становятся
+        доступны другим экземплярам и следующему запуску
+        """
+        self._db.execute("DELETE FROM instances WHERE owner = ?", (self.owner,))
+        self._db.commit()
+
+    def claim_unfinished(self, include_own: bool = False) -> list:
+        """
+        Забрать прерванные задания экземпляров, которые перестали отмечаться,
+        а с include_own=True (при запуске) - и свои, оставшиеся с прошлого запуска
+        """
+        orphaned_before = time.time() - ORPHAN_TIMEOUT
+        rows = self._db.execute(
+            "SELECT jobs.* FROM jobs LEFT JOIN instances ON instances.owner = jobs.owner "
+            "WHERE (jobs.owner = ? AND ?) OR (jobs.owner != ? AND "
+            "(instances.seen_at IS NULL OR instances.seen_at < ?)) "
+            "ORDER BY jobs.id",
+            (self.owner, include_own, self.owner, orphaned_before)
+        ).fetchall()
+
+        claimed = []
+        for row in rows:
+            # Обновление с проверкой владельца атомарно: задание заберёт только один экземпляр
+            cursor = self._db.execute(
+                "UPDATE jobs SET owner = ?, attempts = attempts + 1, updated_at = ? "
+                "WHERE id = ? AND owner = ?",
+                (self.owner, time.time(), row["id"], row["owner"])
+            )
+            if cursor.rowcount:
+                job = dict(row)
+                job["attempts"] += 1
+                claimed.append(job)
+        self._db.commit()
+        return claimed
+
+    def close(self):
+        self._db.close()
+
+
+job_store = None
+
+def init_job_store(path: str, partial_dir: str, owner: str = None):
+    """Инициализация журнала заданий"""
+    global job_store
+    try:
+        job_store = JobStore(path, partial_dir, owner)
+        logger.info(f"Job store initialized at {path} (instance {job_store.owner})")
+    except (OSError, sqlite3.Error) as e:
+        logger.error(f"Job store init error: {e}")
+        job_store = None
+
+def retire_job_store():
+    """Снятие отметки о работе экземпляра при остановке бота"""
+    if job_store is None:
+        return
+    try:
+        job_store.retire()
+    except sqlite3.Error as e:
+        logger.error(f"Job store retire error: {e}")
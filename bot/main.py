@@ -1,12 +1,27 @@
 import asyncio
+import signal
 import logging
 from aiogram import Bot, Dispatcher
 from aiogram.enums import ParseMode
 from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
 from dotenv import load_dotenv
 import os
 
-from bot.handlers import router
+from bot.handlers import router, recover_jobs, cancel_requests
+from bot.cache import init_track_cache, DEFAULT_TTL
+from bot.file_cache import init_audio_cache
+from bot.search_index import init_search_index
+from bot.http_client import init_http_session, close_http_session
+from bot.scheduler import init_job_scheduler
+from bot.transcode import init_transcoder, shutdown_transcoder
+from bot.throttle import TelegramThrottle
+from bot.services import init_api_cache, cleanup_temp_files
+from bot.jobs import init_job_store, retire_job_store
+from bot.yandex_clients import init_client_pool, load_tokens
+from bot.storage import create_redis
+from bot.metrics import start_metrics_server
 
 # Загрузка переменных окружения
 load_dotenv()
@@ -21,26 +36,177 @@ logger = logging.getLogger(__name__)
 async def main():
     # Получение токенов из переменных окружения
     TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
-    YANDEX_MUSIC_TOKEN = os.getenv("YANDEX_MUSIC_TOKEN")
+    YANDEX_MUSIC_TOKENS = load_tokens(
+        ",".join(filter(None, [os.getenv("YANDEX_MUSIC_TOKEN"), os.getenv("YANDEX_MUSIC_TOKENS")])),
+        os.getenv("YANDEX_MUSIC_TOKENS_FILE"),
+    )
     
     if not TELEGRAM_BOT_TOKEN:
         logger.error("TELEGRAM_BOT_TOKEN not found in environment variables")
         return
     
-    if not YANDEX_MUSIC_TOKEN:
+    if not YANDEX_MUSIC_TOKENS:
         logger.warning("YANDEX_MUSIC_TOKEN not found. Some features may be limited.")
     
+    # Метрики Prometheus на /metrics (необязательно)
+    METRICS_PORT = os.getenv("METRICS_PORT")
+    if METRICS_PORT:
+        start_metrics_server(int(METRICS_PORT), os.getenv("METRICS_HOST", "0.0.0.0"))
+    
+    # Пул клиентов Яндекс.Музыки, по одному на токен
+    await init_client_pool(YANDEX_MUSIC_TOKENS)
+    
+    # Общее хранилище для нескольких экземпляров бота (необязательно)
+    REDIS_URL = os.getenv("REDIS_URL")
+    redis = create_redis(REDIS_URL) if REDIS_URL else None
+    
+    # Кэш метаданных треков и прямых ссылок в памяти
+    init_api_cache(
+        metadata_ttl=int(os.getenv("METADATA_CACHE_TTL", 24 * 3600)),
+        link_ttl=int(os.getenv("DIRECT_LINK_CACHE_TTL", 300)),
+        maxsize=int(os.getenv("API_CACHE_SIZE", 10000)),
+    )
+    
+    # Кэш file_id отправленных треков
+    init_track_cache(
+        os.getenv("TRACK_CACHE_PATH", "data/cache.db"),
+        int(os.getenv("TRACK_CACHE_TTL", DEFAULT_TTL)),
+        redis=redis
+    )
+    
+    # Поисковый индекс отправленных треков для inline-режима
+    init_search_index(os.getenv("SEARCH_INDEX_PATH", "data/search.db"))
+    
+    # Кэш скачанных файлов на диске (размер в мегабайтах, 0 - отключён)
+    init_audio_cache(
+        os.getenv("AUDIO_CACHE_DIR", "data/audio"),
+        int(os.getenv("AUDIO_CACHE_MAX_MB", 1024)) * 1024 * 1024
+    )
+    
+    # Общий HTTP-клиент для скачивания треков
+    init_http_session(
+        pool_limit=int(os.getenv("HTTP_POOL_LIMIT", 100)),
+        pool_limit_per_host=int(os.getenv("HTTP_POOL_LIMIT_PER_HOST", 10)),
+        chunk_size=int(os.getenv("DOWNLOAD_CHUNK_SIZE", 64 * 1024)),
+        retries=int(os.getenv("DOWNLOAD_RETRIES", 3)),
+        stream_threshold=int(os.getenv("STREAM_UPLOAD_THRESHOLD")) if os.getenv("STREAM_UPLOAD_THRESHOLD") else None,
+    )
+    
+    # Временные файлы, оставшиеся после аварийного завершения
+    cleanup_temp_files()
+    
+    # Журнал заданий: прерванные перезапуском задания продолжаются при запуске
+    init_job_store(
+        os.getenv("JOBS_DB_PATH", "data/jobs.db"),
+        os.getenv("PARTIAL_DOWNLOADS_DIR", "data/partial"),
+        owner=os.getenv("INSTANCE_ID"),
+    )
+    
+    # Пул процессов для перекодирования (0 - по числу ядер)
+    init_transcoder(
+        workers=int(os.getenv("TRANSCODE_WORKERS", 0)) or None,
+        max_file_size=int(os.getenv("TRANSCODE_MAX_FILE_MB", 50)) * 1024 * 1024,
+    )
+    
+    # Ограничение одновременных скачиваний и очередь заданий
+    init_job_scheduler(
+        max_concurrent=int(os.getenv("MAX_CONCURRENT_JOBS", 4)),
+        max_per_user=int(os.getenv("MAX_JOBS_PER_USER", 1)),
+        max_queue=int(os.getenv("MAX_QUEUE_SIZE", 100)),
+        max_queued_per_user=int(os.getenv("MAX_QUEUED_PER_USER", 10)),
+    )
+    
     # Инициализация бота и диспетчера
     bot = Bot(token=TELEGRAM_BOT_TOKEN, parse_mode=ParseMode.HTML)
-    storage = MemoryStorage()
+    
+    # Все исходящие запросы проходят через ограничитель частоты Telegram
+    throttle = TelegramThrottle(
+        global_rate=float(os.getenv("TELEGRAM_GLOBAL_RATE", 30)),
+        chat_rate=float(os.getenv("TELEGRAM_CHAT_RATE", 1)),
+        group_rate=float(os.getenv("TELEGRAM_GROUP_RATE_PER_MINUTE", 20)) / 60,
+    )
+    bot.session.middleware(throttle)
+    if redis is not None:
+        # Импорт здесь: модуль хранилища требует установленный пакет redis
+        from aiogram.fsm.storage.redis import RedisStorage
+        storage = RedisStorage(redis=redis)
+    else:
+        storage = MemoryStorage()
     dp = Dispatcher(storage=storage)
     
     # Регистрация роутеров
     dp.include_router(router)
     
     # Запуск бота
-    logger.info("Bot starting...")
-    await dp.start_polling(bot)
+    WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+    recovery = asyncio.create_task(recover_jobs(bot))
+    try:
+        if WEBHOOK_URL:
+            await run_webhook(bot, dp, WEBHOOK_URL, throttle)
+        else:
+            logger.info("Bot starting...")
+            # Сессия закрывается ниже, после отмены обрабатываемых ссылок
+            await dp.start_polling(bot, close_bot_session=False)
+    finally:
+        recovery.cancel()
+        await cancel_requests()
+        retire_job_store()
+        # Отложенные обновления статусов уходят до закрытия сессии
+        await throttle.drain()
+        await bot.session.close()
+        await close_http_session()
+        await dp.storage.close()
+        shutdown_transcoder()
+
+async def run_webhook(bot: Bot, dp: Dispatcher, webhook_url: str, throttle: TelegramThrottle = None):
+    """
+    Запуск бота в режиме webhook.
+    Несколько процессов могут слушать один порт (SO_REUSEPORT) или стоять
+    за балансировщиком - состояние FSM и кэши хранятся в общем Redis
+    """
+    path = os.getenv("WEBHOOK_PATH", "/webhook")
+    host = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+    port = int(os.getenv("WEBHOOK_PORT", 8080))
+    secret = os.getenv("WEBHOOK_SECRET")
+    
+    # Повторная установка того же webhook безопасна, поэтому её делает каждый экземпляр
+    await bot.set_webhook(
+        url=webhook_url.rstrip("/") + path,
+        secret_token=secret,
+        allowed_updates=dp.resolve_used_update_types()
+    )
+    
+    app = web.Application()
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=secret).register(app, path=path)
+    setup_application(app, dp, bot=bot)
+    
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port, reuse_port=True)
+    await site.start()
+    logger.info(f"Bot starting in webhook mode on {host}:{port}{path}")
+    
+    # docker stop присылает SIGTERM: без обработчика процесс убивается через 10 секунд
+    # без очистки, а так штатно закрываются сессии и снимается отметка экземпляра
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            # Windows не поддерживает обработчики сигналов в цикле событий
+            pass
+    
+    try:
+        await stop.wait()
+        logger.info("Stopping webhook server...")
+    finally:
+        # Очистка приложения закрывает сессию бота - ссылки отменяются
+        # и отложенные обновления статусов отправляются раньше
+        await cancel_requests()
+        if throttle is not None:
+            await throttle.drain()
+        await runner.cleanup()
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,81 @@
+import logging
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+
+logger = logging.getLogger(__name__)
+
+# Границы гистограмм: от быстрых запросов к API до долгих загрузок
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+# Длительность этапов обработки запроса:
+# metadata, download_info, direct_link, download, upload, queue_wait, request,
+# search, inline, transcode, telegram_wait
+STAGE_LATENCY = Histogram(
+    "ymbot_stage_duration_seconds",
+    "Длительность этапов обработки запроса",
+    ["stage"],
+    buckets=LATENCY_BUCKETS,
+)
+
+# Результаты запросов: sent, cached, coalesced, error, rejected
+REQUESTS = Counter(
+    "ymbot_requests_total",
+    "Обработанные запросы",
+    ["kind", "result"],
+)
+
+# Обращения к кэшам: result = hit | miss
+CACHE_REQUESTS = Counter(
+    "ymbot_cache_requests_total",
+    "Обращения к кэшам",
+    ["cache", "result"],
+)
+
+QUEUE_DEPTH = Gauge("ymbot_queue_depth", "Задания, ожидающие в очереди")
+RUNNING_JOBS = Gauge("ymbot_running_jobs", "Выполняемые задания")
+
+# Исходящие запросы к Telegram: sent, deferred (редактирование отложено в фон),
+# coalesced (пропущенное устаревшее редактирование), flood_wait (ответ 429)
+TELEGRAM_REQUESTS = Counter(
+    "ymbot_telegram_requests_total",
+    "Исходящие запросы к Telegram Bot API",
+    ["method", "result"],
+)
+
+# Запросы к API Яндекс.Музыки по токенам: token = token-N | anonymous,
+# result = ok | unauthorized | throttled | error
+YANDEX_REQUESTS = Counter(
+    "ymbot_yandex_requests_total",
+    "Запросы к API Яндекс.Музыки по токенам",
+    ["token", "result"],
+)
+YANDEX_IN_FLIGHT = Gauge("ymbot_yandex_in_flight", "Выполняемые запросы по токенам", ["token"])
+YANDEX_CLIENT_UP = Gauge("ymbot_yandex_client_up", "Токен доступен (1) или отключён (0)", ["token"])
+
+# Переданные байты: direction = download | upload
+BYTES = Counter(
+    "ymbot_bytes_total",
+    "Переданные данные",
+    ["direction"],
+)
+
+# Ошибки по классам: compat_fallback, unauthorized, metadata, download_info,
+# download, too_small, search, transcode, telegram, unexpected
+ERRORS = Counter(
+    "ymbot_errors_total",
+    "Ошибки по классам",
+    ["kind"],
+)
+
+
+def timed(stage: str):
+    """Замер длительности этапа (контекстный менеджер или декоратор)"""
+    return STAGE_LATENCY.labels(stage).time()
+
+def record_cache(cache: str, hit: bool):
+    """Учёт попадания или промаха кэша"""
+    CACHE_REQUESTS.labels(cache, "hit" if hit else "miss").inc()
+
+def start_metrics_server(port: int, host: str = "0.0.0.0"):
+    """Запуск HTTP-сервера с метриками на /metrics"""
+    start_http_server(port, addr=host)
+    logger.info(f"Metrics server started on {host}:{port}")
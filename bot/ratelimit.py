@@ -0,0 +1,73 @@
+import time
+import asyncio
+
+
+class TokenBucket:
+    """Ограничение частоты: rate операций в секунду с запасом burst"""
+
+    def __init__(self, rate: float, burst: float = 1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self, reserve: float = 0) -> bool:
+        """Взять токен, если он есть, без ожидания (оставив в корзине не меньше reserve)"""
+        self._refill()
+        if self.tokens >= 1 + reserve:
+            self.tokens -= 1
+            return True
+        return False
+
+    def delay(self, reserve: float = 0) -> float:
+        """Через сколько секунд появится свободный токен"""
+        self._refill()
+        if self.tokens >= 1 + reserve:
+            return 0.0
+        return (1 + reserve - self.tokens) / self.rate
+
+    async def acquire(self):
+        """
+        Взять токен, дождавшись его появления.
+        Токен резервируется сразу, поэтому ожидающие обслуживаются по порядку
+        """
+        self._refill()
+        self.tokens -= 1
+        if self.tokens < 0:
+            await asyncio.sleep(-self.tokens / self.rate)
+
+    def pause(self, seconds: float):
+        """Не выдавать токены в течение seconds (например, после ответа 429)"""
+        self._refill()
+        self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+    @property
+    def idle(self) -> bool:
+        """Корзина полна - ею давно не пользовались"""
+        self._refill()
+        return self.tokens >= self.burst
+
+
+class Debouncer:
+    """
+    Подавление частых повторных вызовов по ключу.
+    Вызов проходит, только если за время delay не пришёл более новый с тем же ключом
+    """
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self._latest = {}
+
+    async def wait(self, key) -> bool:
+        marker = object()
+        self._latest[key] = marker
+        await asyncio.sleep(self.delay)
+        if self._latest.get(key) is not marker:
+            return False
+        del self._latest[key]
+        return True
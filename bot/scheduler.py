@@ -0,0 +1,207 @@
+import asyncio
+import logging
+from collections import deque
+from bot.metrics import QUEUE_DEPTH, RUNNING_JOBS
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    """Очередь заданий переполнена"""
+
+
+class UserQueueFullError(QueueFullError):
+    """У пользователя слишком много заданий в очереди"""
+
+
+class _Job:
+    def __init__(self, user_id: int, func, on_position):
+        self.user_id = user_id
+        self.func = func
+        self.on_position = on_position
+        self.position = None
+        self.future = asyncio.get_running_loop().create_future()
+
+
+class JobScheduler:
+    """
+    Планировщик заданий скачивания и отправки.
+    Ограничивает общее число одновременных заданий и число заданий одного
+    пользователя, раздаёт слоты пользователям по кругу и отклоняет новые
+    задания при переполнении очереди. Один пользователь не может занять
+    больше max_queued_per_user мест в очереди, чтобы не отказывать остальным
+    """
+
+    def __init__(self, max_concurrent: int = 4, max_per_user: int = 1, max_queue: int = 100,
+                 max_queued_per_user: int = 10):
+        self.max_concurrent = max_concurrent
+        self.max_per_user = max_per_user
+        self.max_queue = max_queue
+        self.max_queued_per_user = max_queued_per_user
+
+        self._queues = {}        # user_id -> deque заданий в ожидании
+        self._order = deque()    # Порядок обхода пользователей
+        self._active = {}        # user_id -> число выполняемых заданий
+        self._running = 0
+        self._pending = 0
+        self._tasks = set()
+        self._closed = False
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    @property
+    def running(self) -> int:
+        return self._running
+
+    async def run(self, user_id: int, func, on_position=None):
+        """
+        Выполнение func() в порядке очереди.
+        on_position(position) вызывается при изменении позиции задания в очереди
+        """
+        if self._closed:
+            # Бот останавливается: задание продолжится после перезапуска
+            raise asyncio.CancelledError()
+        if len(self._queues.get(user_id, ())) >= self.max_queued_per_user:
+            raise UserQueueFullError()
+        if self._pending >= self.max_queue:
+            raise QueueFullError()
+
+        job = _Job(user_id, func, on_position)
+        if user_id not in self._queues:
+            self._queues[user_id] = deque()
+            self._order.append(user_id)
+        self._queues[user_id].append(job)
+        self._pending += 1
+
+        self._dispatch()
+
+        try:
+            return await asyncio.shield(job.future)
+        except asyncio.CancelledError:
+            self._remove(job)
+            raise
+
+    def _dispatch(self):
+        """Запуск заданий, пока есть свободные слоты"""
+        while not self._closed and self._running < self.max_concurrent:
+            job = self._next_job()
+            if job is None:
+                break
+
+            self._pending -= 1
+            self._running += 1
+            self._active[job.user_id] = self._active.get(job.user_id, 0) + 1
+            self._spawn(self._execute(job))
+
+        QUEUE_DEPTH.set(self._pending)
+        RUNNING_JOBS.set(self._running)
+        self._notify_positions()
+
+    def _next_job(self):
+        """Следующее задание: пользователи обходятся по кругу"""
+        for _ in range(len(self._order)):
+            user_id = self._order[0]
+            self._order.rotate(-1)
+            if self._active.get(user_id, 0) >= self.max_per_user:
+                continue
+
+            queue = self._queues[user_id]
+            job = queue.popleft()
+            if not queue:
+                del self._queues[user_id]
+                self._order.remove(user_id)
+            return job
+
+        return None
+
+    async def _execute(self, job: _Job):
+        try:
+            result = await job.func()
+        except asyncio.CancelledError:
+            job.future.cancel()
+            raise
+        except Exception as e:
+            if not job.future.done():
+                job.future.set_exception(e)
+        else:
+            if not job.future.done():
+                job.future.set_result(result)
+        finally:
+            self._running -= 1
+            self._active[job.user_id] -= 1
+            if not self._active[job.user_id]:
+                del self._active[job.user_id]
+            self._dispatch()
+
+    async def shutdown(self, timeout: float = 10):
+        """
+        Остановка бота: новые задания не запускаются, ожидающие и выполняемые
+        отменяются (вызывающий код получает CancelledError)
+        """
+        self._closed = True
+        for queue in self._queues.values():
+            for job in queue:
+                job.future.cancel()
+        tasks = set(self._tasks)
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.wait(tasks, timeout=timeout)
+
+    def _remove(self, job: _Job):
+        """Удаление отменённого задания из очереди"""
+        queue = self._queues.get(job.user_id)
+        if queue and job in queue:
+            queue.remove(job)
+            self._pending -= 1
+            if not queue:
+                del self._queues[job.user_id]
+                self._order.remove(job.user_id)
+            QUEUE_DEPTH.set(self._pending)
+            self._notify_positions()
+
+    def _waiting_jobs(self):
+        """Задания в ожидании в том порядке, в котором они будут запущены"""
+        queues = [self._queues[user_id] for user_id in self._order]
+        depth = max((len(queue) for queue in queues), default=0)
+        for index in range(depth):
+            for queue in queues:
+                if index < len(queue):
+                    yield queue[index]
+
+    def _notify_positions(self):
+        """Сообщение заданиям об изменении их позиции в очереди"""
+        for position, job in enumerate(self._waiting_jobs(), start=1):
+            if job.position == position or job.on_position is None:
+                continue
+            job.position = position
+            self._spawn(self._report_position(job, position))
+
+    def _spawn(self, coro):
+        """Запуск фоновой задачи с сохранением ссылки на неё"""
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    @staticmethod
+    async def _report_position(job: _Job, position: int):
+        try:
+            await job.on_position(position)
+        except Exception as e:
+            logger.warning(f"Queue position update failed: {e}")
+
+
+job_scheduler = None
+
+def init_job_scheduler(max_concurrent: int = 4, max_per_user: int = 1, max_queue: int = 100,
+                       max_queued_per_user: int = 10):
+    """Инициализация планировщика заданий"""
+    global job_scheduler
+    job_scheduler = JobScheduler(max_concurrent, max_per_user, max_queue, max_queued_per_user)
+    logger.info(
+        f"Job scheduler initialized (concurrent {max_concurrent}, "
+        f"per user {max_per_user}, queue {max_queue}, queued per user {max_queued_per_user})"
+    )
+    return job_scheduler
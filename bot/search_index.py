@@ -0,0 +1,78 @@
+import os
+import re
+import sqlite3
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class TrackSearchIndex:
+    """Полнотекстовый индекс отправленных ботом треков (SQLite FTS5)"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            """
+            CREATE VIRTUAL TABLE IF NOT EXISTS tracks USING fts5(
+                track_id UNINDEXED,
+                file_id UNINDEXED,
+                duration UNINDEXED,
+                artist,
+                title,
+                tokenize = 'unicode61 remove_diacritics 2'
+            )
+            """
+        )
+        self._db.commit()
+
+    def add(self, track_id: str, file_id: str, artist: str, title: str, duration: int = 0):
+        """Добавление или обновление трека в индексе"""
+        self._db.execute("DELETE FROM tracks WHERE track_id = ?", (track_id,))
+        self._db.execute(
+            "INSERT INTO tracks (track_id, file_id, duration, artist, title) VALUES (?, ?, ?, ?, ?)",
+            (track_id, file_id, duration, artist, title)
+        )
+        self._db.commit()
+
+    def remove(self, track_id: str):
+        """Удаление трека из индекса (например, если file_id устарел)"""
+        self._db.execute("DELETE FROM tracks WHERE track_id = ?", (track_id,))
+        self._db.commit()
+
+    def search(self, query: str, limit: int = 20) -> list:
+        """Поиск по исполнителю и названию, каждое слово запроса ищется как префикс"""
+        words = re.findall(r"\w+", query.lower())
+        if not words:
+            return []
+
+        match = " ".join(f'"{word}"*' for word in words)
+        rows = self._db.execute(
+            "SELECT track_id, file_id, duration, artist, title FROM tracks "
+            "WHERE tracks MATCH ? ORDER BY rank LIMIT ?",
+            (match, limit)
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def close(self):
+        self._db.close()
+
+
+search_index = None
+
+def init_search_index(path: str):
+    """Инициализация поискового индекса"""
+    global search_index
+    try:
+        search_index = TrackSearchIndex(path)
+        logger.info(f"Search index initialized at {path}")
+    except sqlite3.Error as e:
+        logger.error(f"Search index init error: {e}")
+        search_index = None
@@ -1,48 +1,207 @@
-import asyncio
 import os
+import time
 import tempfile
 import logging
-from yandex_music import Client
-from yandex_music.exceptions import UnauthorizedError, TimedOutError
-import requests
-from pydub import AudioSegment
+from collections import OrderedDict
+from contextlib import contextmanager
+from yandex_music.exceptions import UnauthorizedError
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 import urllib.parse
+from aiogram.types import FSInputFile
+from bot import file_cache, jobs, yandex_clients
+from bot.cache import DEFAULT_QUALITY
+from bot.transcode import PRESETS, transcode, target_bitrate, exceeds_size_limit
+from bot.metrics import ERRORS, record_cache, timed
+from bot.http_client import (
+    download_file, open_stream, save_stream, should_stream, streaming_enabled, StreamingInputFile
+)
 
 logger = logging.getLogger(__name__)
 
-# Инициализация клиента Яндекс.Музыки
-yandex_client = None
+# Файлы меньше этого размера считаются ошибкой доступа
+MIN_FILE_SIZE = 1024
 
-def init_yandex_client(token: str = None):
-    """Инициализация клиента Яндекс.Музыки"""
-    global yandex_client
+# Префикс временных файлов бота
+TEMP_PREFIX = "ymbot-"
+
+# Запас до истечения подписанной ссылки, после которого она не используется
+LINK_EXPIRY_MARGIN = 10
+
+
+class TTLCache:
+    """Кэш в памяти с ограничением размера (LRU) и временем жизни записей"""
+
+    def __init__(self, name: str, maxsize: int, ttl: float):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()    # key -> (истекает в, значение)
+
+    def get(self, key):
+        entry = self._data.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            self._data.move_to_end(key)
+            self.hits += 1
+            record_cache(self.name, True)
+            return entry[1]
+
+        if entry is not None:
+            del self._data[key]
+        self.misses += 1
+        record_cache(self.name, False)
+        return None
+
+    def set(self, key, value, ttl: float = None):
+        if ttl is None:
+            ttl = self.ttl
+        if ttl <= 0:
+            return
+        self._data[key] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        self._data.pop(key, None)
+
+    def __len__(self):
+        return len(self._data)
+
+
+# Метаданные треков почти не меняются - храним их долго
+track_metadata_cache = TTLCache("metadata", 10000, 24 * 3600)
+
+# Прямые ссылки подписаны и живут недолго
+direct_link_cache = TTLCache("direct_link", 10000, 300)
+
+# Результаты поиска для inline-режима
+search_cache = TTLCache("search", 1000, 600)
+
+def init_api_cache(metadata_ttl: int = 24 * 3600, link_ttl: int = 300, maxsize: int = 10000):
+    """Настройка кэшей метаданных и прямых ссылок"""
+    global track_metadata_cache, direct_link_cache
+    track_metadata_cache = TTLCache("metadata", maxsize, metadata_ttl)
+    direct_link_cache = TTLCache("direct_link", maxsize, link_ttl)
+    logger.info(f"API cache initialized (metadata TTL {metadata_ttl}s, link TTL {link_ttl}s)")
+
+def direct_link_ttl() -> float:
+    """
+    Время жизни прямой ссылки в кэше.
+    Ссылка вида https://{host}/get-mp3/{sign}/{ts}{path} не содержит срока действия,
+    поэтому кэшируем её на фиксированное время DIRECT_LINK_CACHE_TTL с запасом.
+    Ссылку, истёкшую раньше, сбрасывает ошибка скачивания
+    """
+    return direct_link_cache.ttl - LINK_EXPIRY_MARGIN
+
+def create_temp_file() -> str:
+    """Создание временного файла для скачиваемого трека"""
+    with tempfile.NamedTemporaryFile(prefix=TEMP_PREFIX, suffix='.mp3', delete=False) as tmp_file:
+        return tmp_file.name
+
+def remove_file(path: str):
+    """Удаление файла, если он существует"""
     try:
-        if token:
-            yandex_client = Client(token).init()
-            logger.info("Yandex Music client initialized with token")
-        else:
-            yandex_client = Client().init()
-            logger.info("Yandex Music client initialized without token")
-    except (UnauthorizedError, TimedOutError) as e:
-        logger.warning(f"Yandex Music client init error: {e}")
-        yandex_client = Client().init()
-    except Exception as e:
-        logger.error(f"Unexpected error initializing Yandex client: {e}")
-        yandex_client = None
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning(f"Failed to remove {path}: {e}")
+
+def release_download(result: dict):
+    """Освобождение ресурсов скачанного трека: потока CDN, временного файла или файла кэша"""
+    audio = result.get("audio")
+    if isinstance(audio, StreamingInputFile):
+        audio.close()
+    if result.get("file_path") and result.get("temporary"):
+        remove_file(result["file_path"])
+    if result.get("pinned") and file_cache.audio_cache is not None:
+        file_cache.audio_cache.unpin(result["file_path"])
+        result["pinned"] = False
+
+def uploaded_bytes(result: dict) -> int:
+    """Размер отправленного в Telegram файла"""
+    audio = result.get("audio")
+    if isinstance(audio, StreamingInputFile):
+        return audio.bytes_read
+    if result.get("file_path") and os.path.exists(result["file_path"]):
+        return os.path.getsize(result["file_path"])
+    return 0
 
-async def download_yandex_music_track(url: str):
+# Недокачанные файлы, которые сейчас пишутся в этом процессе
+_partial_in_use = set()
+
+@contextmanager
+def partial_download(track_id: str, bitrate):
+    """
+    Постоянный путь недокачанного файла трека: после перезапуска загрузка
+    продолжается с того же места. None - продолжать негде (журнал заданий
+    и кэш выключены) или файл уже качает другая задача
+    """
+    audio_cache = file_cache.audio_cache
+    if audio_cache is not None:
+        directory = audio_cache.tmp_dir
+    elif jobs.job_store is not None:
+        directory = jobs.job_store.partial_dir
+    else:
+        yield None
+        return
+
+    path = os.path.join(directory, f"{track_id}-{bitrate}{jobs.PARTIAL_SUFFIX}")
+    if path in _partial_in_use:
+        yield None
+        return
+
+    _partial_in_use.add(path)
+    try:
+        with open(path, "ab") as lock_file:
+            # Тот же каталог может использовать другой экземпляр бота
+            if fcntl is not None:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    yield None
+                    return
+            yield path
+    finally:
+        _partial_in_use.discard(path)
+
+def claim_partial(path: str) -> str:
+    """Перенос докачанного файла под уникальное имя, свободное для следующих загрузок"""
+    fd, temp_path = tempfile.mkstemp(prefix=TEMP_PREFIX, suffix='.mp3', dir=os.path.dirname(path))
+    os.close(fd)
+    os.replace(path, temp_path)
+    return temp_path
+
+def cleanup_temp_files(max_age: int = 3600):
+    """Удаление временных файлов, оставшихся после прошлых запусков"""
+    directory = tempfile.gettempdir()
+    now = time.time()
+    removed = 0
+    for name in os.listdir(directory):
+        if not name.startswith(TEMP_PREFIX):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            if now - os.path.getmtime(path) > max_age:
+                os.remove(path)
+                removed += 1
+        except OSError:
+            continue
+    if removed:
+        logger.info(f"Removed {removed} stale temp files")
+
+async def download_yandex_music_track(url: str, quality: str = DEFAULT_QUALITY):
     """
     Скачивание трека из Яндекс.Музыки
     Возвращает словарь с результатом
     """
     try:
-        # Инициализация клиента при необходимости
-        if yandex_client is None:
-            from bot.main import os as os_module
-            token = os_module.getenv("YANDEX_MUSIC_TOKEN")
-            init_yandex_client(token)
-        
-        if yandex_client is None:
+        if yandex_clients.client_pool is None:
             return {"success": False, "error": "Не удалось инициализировать клиент Яндекс.Музыки"}
         
         # Парсинг ID трека из URL
@@ -52,96 +211,445 @@ async def download_yandex_music_track(url: str):
         
         logger.info(f"Processing track ID: {track_id}")
         
-        # Получение информации о треке с обработкой ошибки совместимости
-        try:
-            # Способ 1: Используем новый API
-            track_short = await asyncio.to_thread(lambda: yandex_client.tracks([track_id]))
-            if track_short and len(track_short) > 0:
-                track = track_short[0]
-            else:
-                return {"success": False, "error": "Трек не найден"}
-                
-        except TypeError as e:
-            if "common_period_duration" in str(e):
-                # Ошибка совместимости - пробуем альтернативный способ
-                logger.warning("Using alternative method due to compatibility issue")
-                try:
-                    # Получаем трек через поиск
-                    search_result = await asyncio.to_thread(
-                        lambda: yandex_client.search(f"trackid:{track_id}", type_="track")
-                    )
-                    if search_result and search_result.tracks and search_result.tracks.results:
-                        track = search_result.tracks.results[0]
-                    else:
-                        return {"success": False, "error": "Трек не найден (альтернативный метод)"}
-                except Exception as alt_e:
-                    logger.error(f"Alternative method error: {alt_e}")
-                    return {"success": False, "error": f"Ошибка получения трека: {alt_e}"}
-            else:
-                return {"success": False, "error": f"Ошибка получения трека: {e}"}
-        except Exception as e:
-            logger.error(f"Track fetch error: {e}")
-            return {"success": False, "error": f"Ошибка получения трека: {e}"}
+        fetched = await fetch_track(track_id)
+        if not fetched["success"]:
+            return fetched
         
-        # Получение названия и исполнителя
-        try:
-            title = track.title or "Без названия"
-            if hasattr(track, 'artists') and track.artists:
-                artist = track.artists[0].name if hasattr(track.artists[0], 'name') else "Неизвестный исполнитель"
-            else:
-                artist = "Неизвестный исполнитель"
-        except Exception as e:
-            logger.warning(f"Error getting metadata: {e}")
-            title = "Без названия"
+        return await download_track_variant(fetched["track"], quality)
+        
+    except Exception as e:
+        logger.error(f"Error downloading track: {e}", exc_info=True)
+        ERRORS.labels("unexpected").inc()
+        return {"success": False, "error": f"Внутренняя ошибка: {str(e)}"}
+
+async def fetch_track(track_id: str):
+    """Получение информации о треке с обработкой ошибки совместимости"""
+    track = track_metadata_cache.get(track_id)
+    if track is not None:
+        return {"success": True, "track": track}
+    
+    with timed("metadata"):
+        result = await _fetch_track(track_id)
+    if not result["success"]:
+        ERRORS.labels("metadata").inc()
+    else:
+        track_metadata_cache.set(track_id, result["track"])
+    return result
+
+async def _fetch_track(track_id: str):
+    try:
+        # Способ 1: Используем новый API
+        async with yandex_clients.client_pool.client() as client:
+            track_short = await client.tracks([track_id])
+        if track_short and len(track_short) > 0:
+            return {"success": True, "track": track_short[0]}
+        return {"success": False, "error": "Трек не найден"}
+            
+    except TypeError as e:
+        if "common_period_duration" in str(e):
+            # Ошибка совместимости - пробуем альтернативный способ
+            logger.warning("Using alternative method due to compatibility issue")
+            ERRORS.labels("compat_fallback").inc()
+            try:
+                # Получаем трек через поиск
+                async with yandex_clients.client_pool.client() as client:
+                    search_result = await client.search(f"trackid:{track_id}", type_="track")
+                if search_result and search_result.tracks and search_result.tracks.results:
+                    return {"success": True, "track": search_result.tracks.results[0]}
+                return {"success": False, "error": "Трек не найден (альтернативный метод)"}
+            except Exception as alt_e:
+                logger.error(f"Alternative method error: {alt_e}")
+                return {"success": False, "error": f"Ошибка получения трека: {alt_e}"}
+        return {"success": False, "error": f"Ошибка получения трека: {e}"}
+    except UnauthorizedError as e:
+        logger.error(f"Track fetch unauthorized: {e}")
+        return {"success": False, "error": f"Ошибка авторизации, проверьте токен Яндекс.Музыки: {e}"}
+    except Exception as e:
+        logger.error(f"Track fetch error: {e}")
+        return {"success": False, "error": f"Ошибка получения трека: {e}"}
+
+def get_track_metadata(track):
+    """Получение названия, исполнителя и длительности трека"""
+    try:
+        title = track.title or "Без названия"
+        if hasattr(track, 'artists') and track.artists:
+            artist = track.artists[0].name if hasattr(track.artists[0], 'name') else "Неизвестный исполнитель"
+        else:
             artist = "Неизвестный исполнитель"
+    except Exception as e:
+        logger.warning(f"Error getting metadata: {e}")
+        title = "Без названия"
+        artist = "Неизвестный исполнитель"
+    
+    duration = (getattr(track, 'duration_ms', None) or 0) // 1000
+    return title, artist, duration
+
+async def download_track(track, stream: bool = True):
+    """
+    Скачивание уже полученного трека.
+    В результате audio - файл для отправки в Telegram: временный файл на диске
+    или поток из CDN (если включена потоковая отправка и stream=True)
+    """
+    try:
+        title, artist, duration = get_track_metadata(track)
+        track_id = str(track.id)
+        
+        result = {
+            "success": True,
+            "track_id": track_id,
+            "file_path": None,
+            "temporary": False,
+            "title": title,
+            "artist": artist,
+            "duration": duration
+        }
+        filename = f"{artist} - {title}.mp3".replace("/", "_")
+        audio_cache = file_cache.audio_cache
+        
+        # Трек уже скачивался - отдаём файл с диска без обращений к Яндексу
+        if audio_cache is not None:
+            cached = audio_cache.lookup(track_id)
+            record_cache("audio_file", cached is not None)
+            if cached:
+                result["file_path"] = cached[0]
+                result["bitrate"] = int(cached[1])
+                result["pinned"] = True
+                audio_cache.pin(cached[0])
+                result["audio"] = FSInputFile(cached[0], filename=filename)
+                return result
         
         # Получение ссылки на скачивание
-        try:
-            download_info = await asyncio.to_thread(
-                lambda: track.get_download_info(get_direct_links=True)
-            )
+        link = await resolve_direct_link(track)
+        if not link["success"]:
+            return link
+        direct_link, bitrate = link["direct_link"], link["bitrate"]
+        result["bitrate"] = bitrate
+        
+        # При включённом кэше файл пишется сразу на его диск,
+        # чтобы затем атомарно переименовать его в кэш
+        new_temp_file = audio_cache.create_temp_file if audio_cache is not None else create_temp_file
+        
+        # Потоковая отправка: тело ответа CDN уходит в Telegram без записи на диск
+        if stream and streaming_enabled():
+            response = await open_stream(direct_link)
+            if response is None:
+                direct_link_cache.invalidate(track_id)
+                ERRORS.labels("download").inc()
+                return {"success": False, "error": "Ошибка скачивания файла"}
             
-            if not download_info:
-                return {"success": False, "error": "Не удалось получить информацию для скачивания"}
+            # Проверка размера файла по Content-Length
+            if response.content_length is not None and response.content_length < MIN_FILE_SIZE:
+                response.release()
+                ERRORS.labels("too_small").inc()
+                return {"success": False, "error": "Скачанный файл слишком мал (возможно, ошибка доступа)"}
             
-            # Выбор наилучшего качества
-            best_quality = max(download_info, key=lambda x: getattr(x, 'bitrate_in_kbps', 0))
-            direct_link = await asyncio.to_thread(lambda: best_quality.get_direct_link())
+            if should_stream(response.content_length):
+                audio = StreamingInputFile(response, filename)
+                try:
+                    # Без Content-Length размер проверяется по первым прочитанным байтам
+                    if response.content_length is None and await audio.prefetch(MIN_FILE_SIZE) < MIN_FILE_SIZE:
+                        audio.close()
+                        ERRORS.labels("too_small").inc()
+                        return {"success": False, "error": "Скачанный файл слишком мал (возможно, ошибка доступа)"}
+                except BaseException:
+                    audio.close()
+                    raise
+                result["audio"] = audio
+                return result
             
-            if not direct_link:
-                return {"success": False, "error": "Не удалось получить прямую ссылку"}
-                
-        except Exception as e:
-            logger.error(f"Download info error: {e}")
-            return {"success": False, "error": f"Ошибка получения информации для скачивания: {e}"}
-        
-        # Создание временного файла
-        with tempfile.NamedTemporaryFile(suffix='.mp3', delete=False) as tmp_file:
-            temp_path = tmp_file.name
+            # Небольшой файл дочитываем из уже открытого ответа во временный файл
+            temp_path = new_temp_file()
+            try:
+                with timed("download"):
+                    download_success = await save_stream(response, temp_path)
+            except BaseException:
+                remove_file(temp_path)
+                raise
+        else:
+            with partial_download(track_id, bitrate) as partial_path:
+                if partial_path is not None:
+                    # Недокачанный файл остаётся на диске и при ошибке,
+                    # и при остановке бота - следующая попытка продолжит его
+                    with timed("download"):
+                        download_success = await download_file(direct_link, partial_path, resume=True)
+                    temp_path = claim_partial(partial_path) if download_success else None
+                else:
+                    temp_path = new_temp_file()
+                    try:
+                        with timed("download"):
+                            download_success = await download_file(direct_link, temp_path)
+                    except BaseException:
+                        remove_file(temp_path)
+                        raise
         
-        # Скачивание файла
-        download_success = await download_file(direct_link, temp_path)
         if not download_success:
-            os.remove(temp_path)
+            if temp_path is not None:
+                remove_file(temp_path)
+            # Ссылка могла истечь раньше срока - в следующий раз получим новую
+            direct_link_cache.invalidate(track_id)
+            ERRORS.labels("download").inc()
             return {"success": False, "error": "Ошибка скачивания файла"}
         
         # Проверка размера файла
-        if os.path.getsize(temp_path) < 1024:  # Меньше 1KB
-            os.remove(temp_path)
+        if os.path.getsize(temp_path) < MIN_FILE_SIZE:
+            remove_file(temp_path)
+            ERRORS.labels("too_small").inc()
             return {"success": False, "error": "Скачанный файл слишком мал (возможно, ошибка доступа)"}
         
-        return {
-            "success": True,
-            "file_path": temp_path,
-            "title": title,
-            "artist": artist,
-            "duration": getattr(track, 'duration_ms', 0) // 1000 if hasattr(track, 'duration_ms') else 0
-        }
+        if audio_cache is not None:
+            result["file_path"] = await audio_cache.put(track_id, str(bitrate), temp_path, pin=True)
+            result["pinned"] = True
+        else:
+            result["file_path"] = temp_path
+            result["temporary"] = True
+        
+        result["audio"] = FSInputFile(result["file_path"], filename=filename)
+        return result
         
     except Exception as e:
         logger.error(f"Error downloading track: {e}", exc_info=True)
+        ERRORS.labels("unexpected").inc()
         return {"success": False, "error": f"Внутренняя ошибка: {str(e)}"}
 
+def variant_key(quality: str) -> str:
+    """Ключ перекодированного варианта в кэше файлов"""
+    return f"preset:{quality}"
+
+async def download_track_variant(track, quality: str = DEFAULT_QUALITY, stream: bool = True):
+    """
+    Скачивание трека в выбранном качестве.
+    Для пресета (128/192/320) оригинал перекодируется, для наилучшего
+    качества - только если файл не укладывается в лимит Telegram
+    """
+    track_id = str(track.id)
+    audio_cache = file_cache.audio_cache
+    key = quality if quality in PRESETS else "capped"
+    
+    # Готовый перекодированный вариант из кэша
+    if audio_cache is not None:
+        cached_path = audio_cache.get(track_id, variant_key(key))
+        if quality in PRESETS:
+            record_cache("variant", cached_path is not None)
+        if cached_path:
+            title, artist, duration = get_track_metadata(track)
+            audio_cache.pin(cached_path)
+            return {
+                "success": True,
+                "track_id": track_id,
+                "file_path": cached_path,
+                "temporary": False,
+                "pinned": True,
+                "title": title,
+                "artist": artist,
+                "duration": duration,
+                "audio": FSInputFile(cached_path, filename=f"{artist} - {title}.mp3".replace("/", "_"))
+            }
+    
+    if quality not in PRESETS:
+        result = await download_track(track, stream=stream)
+        if not result["success"]:
+            return result
+        # Поток больше лимита Telegram отклонит - скачиваем файл на диск для перекодирования
+        if isinstance(result["audio"], StreamingInputFile) and exceeds_size_limit(result["audio"].content_length):
+            release_download(result)
+            result = await download_track(track, stream=False)
+            if not result["success"]:
+                return result
+        if result.get("file_path") and exceeds_size_limit(os.path.getsize(result["file_path"])):
+            logger.info(f"Track {track_id} exceeds upload limit, re-encoding")
+            return await make_variant(track, result, key, result.get("bitrate") or PRESETS["320"])
+        return result
+    
+    original = await download_track(track, stream=False)
+    if not original["success"]:
+        return original
+    
+    # Пресет не выше битрейта оригинала: перекодирование только увеличит файл
+    # или добавит потерь, поэтому отправляется сам оригинал
+    source_bitrate = original.get("bitrate")
+    if source_bitrate and source_bitrate <= PRESETS[quality]:
+        if not exceeds_size_limit(os.path.getsize(original["file_path"])):
+            return original
+        return await make_variant(track, original, key, source_bitrate)
+    return await make_variant(track, original, key, PRESETS[quality])
+
+async def make_variant(track, original: dict, key: str, bitrate: int):
+    """Перекодирование скачанного трека с тегами и обложкой"""
+    audio_cache = file_cache.audio_cache
+    title, artist, duration = original["title"], original["artist"], original["duration"]
+    bitrate = target_bitrate(bitrate, duration)
+    
+    tags = {"title": title, "artist": artist}
+    if getattr(track, 'albums', None):
+        tags["album"] = track.albums[0].title or ""
+    
+    # Обложка не обязательна: при ошибке трек перекодируется без неё
+    cover = None
+    if getattr(track, 'cover_uri', None):
+        try:
+            cover = await track.download_cover_bytes_async(size="400x400")
+        except Exception as e:
+            logger.warning(f"Cover download error: {e}")
+    
+    dst = audio_cache.create_temp_file() if audio_cache is not None else create_temp_file()
+    try:
+        with timed("transcode"):
+            await transcode(original["file_path"], dst, bitrate, tags, cover)
+    except Exception as e:
+        remove_file(dst)
+        logger.error(f"Transcode error: {e}")
+        ERRORS.labels("transcode").inc()
+        return {"success": False, "error": f"Ошибка перекодирования трека: {e}"}
+    except BaseException:
+        remove_file(dst)
+        raise
+    finally:
+        release_download(original)
+    
+    result = dict(original, bitrate=bitrate, temporary=False, pinned=False)
+    if audio_cache is not None:
+        result["file_path"] = await audio_cache.put(result["track_id"], variant_key(key), dst, pin=True)
+        result["pinned"] = True
+    else:
+        result["file_path"] = dst
+        result["temporary"] = True
+    
+    result["audio"] = FSInputFile(result["file_path"], filename=f"{artist} - {title}.mp3".replace("/", "_"))
+    return result
+
+async def resolve_direct_link(track):
+    """Получение прямой ссылки на наилучшее качество трека (с кэшированием)"""
+    track_id = str(track.id)
+    cached = direct_link_cache.get(track_id)
+    if cached is not None:
+        return {"success": True, "direct_link": cached[0], "bitrate": cached[1]}
+    
+    try:
+        # Квота скачиваний своя у каждого аккаунта, поэтому ссылку получает
+        # клиент из пула, а не тот, что загрузил метаданные трека
+        async with yandex_clients.client_pool.client() as client:
+            with timed("download_info"):
+                download_info = await client.tracks_download_info(track_id)
+            
+            if not download_info:
+                return {"success": False, "error": "Не удалось получить информацию для скачивания"}
+            
+            # Выбор наилучшего качества, прямая ссылка запрашивается только для него
+            best_quality = max(download_info, key=lambda x: getattr(x, 'bitrate_in_kbps', 0))
+            with timed("direct_link"):
+                direct_link = await best_quality.get_direct_link_async()
+        
+        if not direct_link:
+            return {"success": False, "error": "Не удалось получить прямую ссылку"}
+            
+    except Exception as e:
+        logger.error(f"Download info error: {e}")
+        if not isinstance(e, UnauthorizedError):
+            ERRORS.labels("download_info").inc()
+        return {"success": False, "error": f"Ошибка получения информации для скачивания: {e}"}
+    
+    bitrate = getattr(best_quality, 'bitrate_in_kbps', 0)
+    direct_link_cache.set(track_id, (direct_link, bitrate), direct_link_ttl())
+    return {"success": True, "direct_link": direct_link, "bitrate": bitrate}
+
+async def search_tracks(query: str, limit: int = 10) -> list:
+    """Поиск треков в Яндекс.Музыке (с кэшированием результатов)"""
+    key = query.strip().lower()
+    cached = search_cache.get(key)
+    if cached is not None:
+        return cached
+    
+    if yandex_clients.client_pool is None:
+        return []
+    
+    try:
+        with timed("search"):
+            async with yandex_clients.client_pool.client() as client:
+                search_result = await client.search(query, type_="track")
+    except Exception as e:
+        logger.warning(f"Search error: {e}")
+        ERRORS.labels("search").inc()
+        return []
+    
+    tracks = []
+    if search_result and search_result.tracks and search_result.tracks.results:
+        tracks = search_result.tracks.results[:limit]
+    
+    found = []
+    for track in tracks:
+        title, artist, duration = get_track_metadata(track)
+        track_metadata_cache.set(str(track.id), track)
+        found.append({
+            "track_id": str(track.id),
+            "title": title,
+            "artist": artist,
+            "duration": duration,
+            "url": get_track_url(track)
+        })
+    
+    search_cache.set(key, found)
+    return found
+
+def get_track_url(track) -> str:
+    """Ссылка на трек в Яндекс.Музыке"""
+    if getattr(track, 'albums', None):
+        return f"https://music.yandex.ru/album/{track.albums[0].id}/track/{track.id}"
+    return f"https://music.yandex.ru/track/{track.id}"
+
+async def fetch_collection(url: str, max_tracks: int = None):
+    """
+    Получение треков альбома или плейлиста.
+    Метаданные всех треков запрашиваются одним запросом.
+    capped - сколько треков не вошло в ограничение max_tracks
+    """
+    if yandex_clients.client_pool is None:
+        return {"success": False, "error": "Не удалось инициализировать клиент Яндекс.Музыки"}
+    
+    collection = extract_collection_from_url(url)
+    if not collection:
+        return {"success": False, "error": "Не удалось извлечь альбом или плейлист из ссылки"}
+    
+    capped = 0
+    try:
+        if collection["type"] == "album":
+            async with yandex_clients.client_pool.client() as client:
+                album = await client.albums_with_tracks(collection["album_id"])
+            if not album:
+                return {"success": False, "error": "Альбом не найден"}
+            
+            title = album.title or "Альбом"
+            # Альбом с треками уже содержит их метаданные
+            tracks = [track for volume in (album.volumes or []) for track in volume]
+        else:
+            async with yandex_clients.client_pool.client() as client:
+                playlist = await client.users_playlists(collection["kind"], collection["user"])
+                if not playlist:
+                    return {"success": False, "error": "Плейлист не найден"}
+                
+                title = playlist.title or "Плейлист"
+                track_ids = [short.track_id for short in (playlist.tracks or [])]
+                if max_tracks and len(track_ids) > max_tracks:
+                    capped = len(track_ids) - max_tracks
+                    track_ids = track_ids[:max_tracks]
+                tracks = await client.tracks(track_ids) if track_ids else []
+    except Exception as e:
+        logger.error(f"Collection fetch error: {e}")
+        return {"success": False, "error": f"Ошибка получения списка треков: {e}"}
+    
+    # Недоступные в регионе треки пропускаем
+    tracks = [track for track in tracks if getattr(track, 'available', True) is not False]
+    for track in tracks:
+        track_metadata_cache.set(str(track.id), track)
+    if max_tracks and len(tracks) > max_tracks:
+        capped += len(tracks) - max_tracks
+        tracks = tracks[:max_tracks]
+    
+    if not tracks:
+        return {"success": False, "error": "В альбоме или плейлисте не найдено доступных треков"}
+    
+    logger.info(f"Processing collection {collection}: {len(tracks)} tracks")
+    return {"success": True, "title": title, "tracks": tracks, "capped": capped}
+
 def extract_track_id_from_url(url: str) -> str:
     """Извлечение ID трека из URL"""
     import re
@@ -162,30 +670,18 @@ def extract_track_id_from_url(url: str) -> str:
     
     return None
 
-async def download_file(url: str, filepath: str):
-    """Асинхронная загрузка файла"""
-    try:
-        loop = asyncio.get_event_loop()
-        
-        def _download():
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-            }
-            response = requests.get(url, headers=headers, stream=True, timeout=30)
-            response.raise_for_status()
-            
-            total_size = int(response.headers.get('content-length', 0))
-            downloaded = 0
-            
-            with open(filepath, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    if chunk:
-                        f.write(chunk)
-                        downloaded += len(chunk)
-            
-            return True
-            
-        return await loop.run_in_executor(None, _download)
-    except Exception as e:
-        logger.error(f"Download error: {e}")
-        return False
\ No newline at end of file
+def extract_collection_from_url(url: str):
+    """Извлечение альбома или плейлиста из URL"""
+    import re
+    
+    url_without_params = url.split('?')[0]
+    
+    match = re.search(r'users/([\w.-]+)/playlists/(\d+)', url_without_params)
+    if match:
+        return {"type": "playlist", "user": match.group(1), "kind": match.group(2)}
+    
+    match = re.search(r'album/(\d+)/?$', url_without_params)
+    if match:
+        return {"type": "album", "album_id": match.group(1)}
+    
+    return None
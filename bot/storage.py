@@ -0,0 +1,87 @@
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryRedis:
+    """
+    Хранилище в памяти процесса с интерфейсом redis.asyncio.Redis.
+    Поддерживает только команды, которые использует бот, и подходит
+    для локального запуска и тестов без сервера Redis
+    """
+
+    def __init__(self):
+        self._data = {}       # key -> bytes
+        self._expires = {}    # key -> время истечения
+
+    @staticmethod
+    def _encode(value) -> bytes:
+        if isinstance(value, bytes):
+            return value
+        return str(value).encode("utf-8")
+
+    def _alive(self, key) -> bool:
+        expires = self._expires.get(key)
+        if expires is not None and expires <= time.monotonic():
+            self._data.pop(key, None)
+            self._expires.pop(key, None)
+        return key in self._data
+
+    async def get(self, key):
+        return self._data.get(key) if self._alive(key) else None
+
+    async def set(self, key, value, ex=None, px=None, nx=False):
+        if nx and self._alive(key):
+            return None
+        self._data[key] = self._encode(value)
+        self._expires.pop(key, None)
+        if ex is not None:
+            self._expires[key] = time.monotonic() + float(ex)
+        elif px is not None:
+            self._expires[key] = time.monotonic() + px / 1000
+        return True
+
+    async def delete(self, *keys) -> int:
+        deleted = 0
+        for key in keys:
+            if self._alive(key):
+                deleted += 1
+            self._data.pop(key, None)
+            self._expires.pop(key, None)
+        return deleted
+
+    async def exists(self, *keys) -> int:
+        return sum(1 for key in keys if self._alive(key))
+
+    async def expire(self, key, seconds) -> bool:
+        if not self._alive(key):
+            return False
+        self._expires[key] = time.monotonic() + float(seconds)
+        return True
+
+    async def incr(self, key, amount: int = 1) -> int:
+        value = int(await self.get(key) or 0) + amount
+        self._data[key] = self._encode(value)
+        return value
+
+    async def ping(self) -> bool:
+        return True
+
+    async def close(self):
+        pass
+
+
+def create_redis(url: str):
+    """
+    Подключение к Redis по URL.
+    memory:// - локальная замена в памяти процесса
+    """
+    if url.startswith("memory://"):
+        logger.info("Using in-memory Redis stand-in")
+        return MemoryRedis()
+
+    from redis.asyncio import Redis
+
+    logger.info("Using Redis shared storage")
+    return Redis.from_url(url)
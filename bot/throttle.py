@@ -0,0 +1,165 @@
+import time
+import asyncio
+import logging
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import DeleteMessage, EditMessageText, SendChatAction
+from bot.ratelimit import TokenBucket
+from bot.http_client import StreamingInputFile
+from bot.metrics import STAGE_LATENCY, TELEGRAM_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+# Ограничения Telegram: около 30 сообщений в секунду на бота,
+# 1 сообщение в секунду в личный чат и 20 в минуту в группу
+GLOBAL_RATE = 30
+CHAT_RATE = 1
+CHAT_BURST = 3
+GROUP_RATE = 20 / 60
+GROUP_BURST = 5
+
+# Сколько токенов редактирования оставляют для отправки сообщений
+EDIT_RESERVE = 1
+
+# Повторы после ответа 429
+MAX_RETRIES = 3
+
+# Корзины чатов хранятся, пока их больше этого числа не наберётся
+MAX_CHAT_BUCKETS = 10000
+
+# Методы, которые не отправляют сообщений и не ограничиваются
+UNTHROTTLED_METHODS = (DeleteMessage, SendChatAction)
+
+
+class TelegramThrottle(BaseRequestMiddleware):
+    """
+    Планировщик исходящих запросов к Bot API.
+    Запросы ждут токенов общей и поканальной корзин, ответ 429 приостанавливает
+    отправку в чат на retry_after и запрос повторяется. Редактирования пропускают
+    вперёд сообщения: при заполненной очереди они отправляются в фоне, а не
+    дождавшееся очереди редактирование отбрасывается, если за ним пришло более
+    новое редактирование того же сообщения или его удаление
+    """
+
+    def __init__(self, global_rate: float = GLOBAL_RATE, chat_rate: float = CHAT_RATE,
+                 group_rate: float = GROUP_RATE, max_retries: int = MAX_RETRIES):
+        self.global_bucket = TokenBucket(global_rate, burst=global_rate)
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.max_retries = max_retries
+        self._chats = {}
+        self._pending_edits = {}
+        self._background = set()
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= MAX_CHAT_BUCKETS:
+                self._chats = {key: value for key, value in self._chats.items() if not value.idle}
+            # Группы и каналы имеют отрицательный id или @username
+            if isinstance(chat_id, int) and chat_id > 0:
+                bucket = TokenBucket(self.chat_rate, burst=CHAT_BURST)
+            else:
+                bucket = TokenBucket(self.group_rate, burst=GROUP_BURST)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, "chat_id", None)
+        if isinstance(method, DeleteMessage):
+            # Удалённое сообщение больше незачем редактировать
+            self._pending_edits.pop((chat_id, method.message_id), None)
+        if chat_id is None or isinstance(method, UNTHROTTLED_METHODS):
+            return await self._send(make_request, bot, method)
+
+        if not isinstance(method, EditMessageText) or not method.message_id:
+            return await self._send(make_request, bot, method, chat_id)
+
+        edit = ((chat_id, method.message_id), object())
+        self._pending_edits[edit[0]] = edit[1]
+        if self._congested(chat_id):
+            # Обработчик не ждёт обновления статуса: оно уйдёт в фоне,
+            # когда освободится очередь, или будет вытеснено более новым
+            TELEGRAM_REQUESTS.labels(method.__api_method__, "deferred").inc()
+            task = asyncio.create_task(self._send_edit(make_request, bot, method, chat_id, edit))
+            self._background.add(task)
+            task.add_done_callback(self._edit_done)
+            # Вызывающий код результат редактирования не использует
+            return True
+        return await self._send_edit(make_request, bot, method, chat_id, edit)
+
+    async def drain(self, timeout: float = 10):
+        """Ожидание отложенных редактирований (перед закрытием сессии)"""
+        if self._background:
+            await asyncio.wait(set(self._background), timeout=timeout)
+
+    def _congested(self, chat_id) -> bool:
+        return (self._chat_bucket(chat_id).delay(reserve=EDIT_RESERVE) > 0
+                or self.global_bucket.delay(reserve=EDIT_RESERVE) > 0)
+
+    def _edit_done(self, task: asyncio.Task):
+        self._background.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(f"Deferred status edit failed: {task.exception()}")
+
+    async def _send_edit(self, make_request, bot, method, chat_id, edit):
+        try:
+            return await self._send(make_request, bot, method, chat_id, edit)
+        finally:
+            if self._pending_edits.get(edit[0]) is edit[1]:
+                del self._pending_edits[edit[0]]
+
+    def _superseded(self, edit) -> bool:
+        return edit is not None and self._pending_edits.get(edit[0]) is not edit[1]
+
+    async def _wait(self, chat_id, edit) -> bool:
+        """Ожидание очереди; False - запрос устарел и отправлять его не нужно"""
+        started = time.monotonic()
+        try:
+            for bucket in (self._chat_bucket(chat_id), self.global_bucket):
+                if edit is None:
+                    await bucket.acquire()
+                    continue
+                # Редактирования статуса не резервируют токен и не берут последний,
+                # уступая очередь сообщениям; пока они ждут, их может вытеснить более новое
+                while not bucket.try_acquire(reserve=EDIT_RESERVE):
+                    await asyncio.sleep(bucket.delay(reserve=EDIT_RESERVE))
+                    if self._superseded(edit):
+                        return False
+            return not self._superseded(edit)
+        finally:
+            STAGE_LATENCY.labels("telegram_wait").observe(time.monotonic() - started)
+
+    async def _send(self, make_request, bot, method, chat_id=None, edit=None):
+        """Отправка с ожиданием очереди (если задан чат) и повтором после 429"""
+        name = method.__api_method__
+        for attempt in range(self.max_retries + 1):
+            if chat_id is not None and not await self._wait(chat_id, edit):
+                TELEGRAM_REQUESTS.labels(name, "coalesced").inc()
+                return True
+
+            try:
+                result = await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                TELEGRAM_REQUESTS.labels(name, "flood_wait").inc()
+                logger.warning(f"Flood control on {name} in chat {chat_id}, retry after {e.retry_after}s")
+                if chat_id is not None:
+                    # Следующие запросы в этот чат тоже подождут retry_after
+                    self._chat_bucket(chat_id).pause(e.retry_after)
+                if attempt >= self.max_retries or not _replayable(method):
+                    raise
+                if chat_id is None:
+                    await asyncio.sleep(e.retry_after)
+                continue
+
+            TELEGRAM_REQUESTS.labels(name, "sent").inc()
+            return result
+
+
+def _replayable(method) -> bool:
+    """Поток из CDN уже прочитан при первой попытке - такой запрос не повторить"""
+    files = [getattr(method, "audio", None)]
+    media = getattr(method, "media", None)
+    if isinstance(media, list):
+        files += [getattr(item, "media", None) for item in media]
+    return not any(isinstance(file, StreamingInputFile) for file in files)
@@ -0,0 +1,111 @@
+import os
+import asyncio
+import tempfile
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Пресеты качества, доступные пользователю (битрейт MP3, кбит/с)
+PRESETS = {
+    "128": 128,
+    "192": 192,
+    "320": 320,
+}
+
+# Ограничение Telegram на размер файла, отправляемого ботом
+TELEGRAM_MAX_FILE_SIZE = 50 * 1024 * 1024
+
+# Ниже этого битрейта перекодирование не имеет смысла
+MIN_BITRATE = 64
+
+config = {
+    "max_file_size": TELEGRAM_MAX_FILE_SIZE,
+}
+
+_pool = None
+
+def init_transcoder(workers: int = None, max_file_size: int = None):
+    """Запуск пула процессов для перекодирования (по умолчанию - по числу ядер)"""
+    global _pool
+    if max_file_size:
+        config["max_file_size"] = max_file_size
+    workers = workers or os.cpu_count() or 1
+    # fork копировал бы в процессы пула цикл событий, сессии и соединения с БД,
+    # поэтому процессы запускаются с чистым интерпретатором
+    method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(method))
+    logger.info(f"Transcoder initialized with {workers} workers")
+
+def shutdown_transcoder():
+    """Остановка пула процессов"""
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+    _pool = None
+
+def target_bitrate(bitrate: int, duration: int) -> int:
+    """
+    Битрейт, при котором файл уложится в лимит размера.
+    Оставляем 5% запаса на заголовки и обложку
+    """
+    if duration > 0:
+        limit = int(config["max_file_size"] * 0.95 * 8 / duration / 1000)
+        bitrate = min(bitrate, limit)
+    return max(bitrate, MIN_BITRATE)
+
+def exceeds_size_limit(size: int) -> bool:
+    """Проверка, что файл такого размера (в байтах) больше допустимого для отправки"""
+    return size is not None and size > config["max_file_size"]
+
+async def transcode(src: str, dst: str, bitrate: int, tags: dict = None, cover: bytes = None):
+    """
+    Перекодирование в MP3 с заданным битрейтом, тегами ID3 и обложкой.
+    Работа выполняется в отдельном процессе и не блокирует цикл событий
+    """
+    cover_path = None
+    if cover:
+        with tempfile.NamedTemporaryFile(prefix="ymbot-", suffix='.jpg', delete=False) as cover_file:
+            cover_file.write(cover)
+            cover_path = cover_file.name
+
+    try:
+        loop = asyncio.get_running_loop()
+        if _pool is None:
+            logger.warning("Transcoder is not initialized, starting it with 1 worker")
+            init_transcoder(1)
+        await loop.run_in_executor(_pool, _encode, src, dst, bitrate, tags or {}, cover_path)
+    finally:
+        if cover_path:
+            try:
+                os.remove(cover_path)
+            except OSError:
+                pass
+
+
+def _encode(src: str, dst: str, bitrate: int, tags: dict, cover_path: str):
+    # Выполняется в дочернем процессе. ffmpeg перекодирует трек потоком,
+    # не загружая его целиком в память
+    import ffmpeg
+
+    streams = [ffmpeg.input(src)["a"]]
+    options = {
+        "format": "mp3",
+        "acodec": "libmp3lame",
+        "b:a": f"{bitrate}k",
+        "id3v2_version": 3,
+    }
+    # Ключи словаря уникальны, поэтому каждый тег - отдельный -metadata:g:N
+    for index, (key, value) in enumerate(tags.items()):
+        options[f"metadata:g:{index}"] = f"{key}={value}"
+    if cover_path:
+        streams.append(ffmpeg.input(cover_path)["v"])
+        options["c:v"] = "mjpeg"
+
+    try:
+        ffmpeg.output(*streams, dst, **options).run(quiet=True, overwrite_output=True)
+    except ffmpeg.Error as e:
+        # ffmpeg.Error не восстанавливается при передаче из процесса пула
+        stderr = e.stderr.decode(errors="replace").strip().splitlines()
+        raise RuntimeError(stderr[-1] if stderr else str(e)) from None
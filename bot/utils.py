@@ -8,7 +8,8 @@ def validate_yandex_music_url(url: str) -> bool:
     patterns = [
         r'^https?://music\.yandex\.(ru|com)/track/\d+',
         r'^https?://music\.yandex\.(ru|com)/album/\d+/track/\d+',
-        r'^https?://music\.yandex\.(ru|com)/users/[\w-]+/playlists/\d+',
+        r'^https?://music\.yandex\.(ru|com)/album/\d+/?$',
+        r'^https?://music\.yandex\.(ru|com)/users/[\w.-]+/playlists/\d+',
     ]
     
     for pattern in patterns:
@@ -0,0 +1,185 @@
+import time
+import logging
+from contextlib import asynccontextmanager
+from yandex_music import ClientAsync
+from yandex_music.exceptions import (
+    UnauthorizedError, NetworkError, BadRequestError, NotFoundError, TimedOutError
+)
+from bot.metrics import ERRORS, YANDEX_CLIENT_UP, YANDEX_IN_FLIGHT, YANDEX_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+# Отключение клиента (circuit breaker): неверный токен проверяется реже,
+# чем ограничение частоты запросов
+UNAUTHORIZED_COOLDOWN = 600
+THROTTLED_COOLDOWN = 30
+MAX_COOLDOWN = 3600
+
+# Столько сетевых ошибок подряд отключают клиент как при ограничении частоты
+FAILURE_THRESHOLD = 5
+
+
+class NoClientAvailableError(Exception):
+    """Все клиенты Яндекс.Музыки временно отключены"""
+
+
+class PooledClient:
+    """Клиент одного аккаунта и состояние его доступности"""
+
+    def __init__(self, name: str, client: ClientAsync):
+        self.name = name
+        self.client = client
+        self.in_flight = 0
+        self.requests = 0
+        self.failures = 0
+        self.trips = 0
+        self.open_until = 0.0
+
+    @property
+    def available(self) -> bool:
+        if time.monotonic() < self.open_until:
+            return False
+        # После отключения клиент сначала проверяется одним запросом
+        return self.trips == 0 or self.in_flight == 0
+
+    def trip(self, cooldown: float, reason: str):
+        """Отключение клиента; повторные отключения подряд всё дольше"""
+        cooldown = min(cooldown * 2 ** self.trips, MAX_COOLDOWN)
+        self.trips += 1
+        self.failures = 0
+        self.open_until = time.monotonic() + cooldown
+        YANDEX_CLIENT_UP.labels(self.name).set(0)
+        logger.warning(f"Yandex client {self.name} disabled for {cooldown:.0f}s: {reason}")
+
+    def reset(self):
+        if self.trips:
+            logger.info(f"Yandex client {self.name} is healthy again")
+        self.trips = 0
+        self.failures = 0
+        self.open_until = 0.0
+        YANDEX_CLIENT_UP.labels(self.name).set(1)
+
+
+class YandexClientPool:
+    """
+    Пул клиентов Яндекс.Музыки с разными токенами.
+    Запрос получает наименее загруженный доступный клиент; клиент с неверным
+    токеном или упёршийся в ограничение частоты на время отключается
+    """
+
+    def __init__(self, clients: list):
+        self.clients = clients
+
+    @property
+    def healthy(self) -> int:
+        return len([entry for entry in self.clients if entry.available])
+
+    def _pick(self) -> PooledClient:
+        candidates = [entry for entry in self.clients if entry.available]
+        if not candidates:
+            raise NoClientAvailableError("Все токены Яндекс.Музыки временно недоступны")
+        return min(candidates, key=lambda entry: (entry.in_flight, entry.requests))
+
+    @asynccontextmanager
+    async def client(self):
+        """Выбор клиента на время запроса с учётом результата"""
+        entry = self._pick()
+        entry.in_flight += 1
+        entry.requests += 1
+        YANDEX_IN_FLIGHT.labels(entry.name).inc()
+        try:
+            yield entry.client
+        except Exception as e:
+            self._record_failure(entry, e)
+            raise
+        else:
+            YANDEX_REQUESTS.labels(entry.name, "ok").inc()
+            entry.reset()
+        finally:
+            entry.in_flight -= 1
+            YANDEX_IN_FLIGHT.labels(entry.name).dec()
+
+    def _record_failure(self, entry: PooledClient, error: Exception):
+        if isinstance(error, UnauthorizedError):
+            YANDEX_REQUESTS.labels(entry.name, "unauthorized").inc()
+            ERRORS.labels("unauthorized").inc()
+            entry.trip(UNAUTHORIZED_COOLDOWN, f"unauthorized: {error}")
+        elif is_throttled(error):
+            YANDEX_REQUESTS.labels(entry.name, "throttled").inc()
+            entry.trip(THROTTLED_COOLDOWN, f"throttled: {error}")
+        elif isinstance(error, NetworkError) and not isinstance(error, (BadRequestError, NotFoundError)):
+            YANDEX_REQUESTS.labels(entry.name, "error").inc()
+            entry.failures += 1
+            if entry.failures >= FAILURE_THRESHOLD:
+                entry.trip(THROTTLED_COOLDOWN, f"{entry.failures} errors in a row: {error}")
+        else:
+            # Ошибка запроса, а не клиента (трек не найден и т.п.)
+            YANDEX_REQUESTS.labels(entry.name, "error").inc()
+
+    def stats(self) -> list:
+        """Использование токенов: запросы, нагрузка и доступность"""
+        return [
+            {
+                "name": entry.name,
+                "requests": entry.requests,
+                "in_flight": entry.in_flight,
+                "available": entry.available,
+            }
+            for entry in self.clients
+        ]
+
+
+def is_throttled(error: Exception) -> bool:
+    """Ответ 429 библиотека превращает в NetworkError с кодом в тексте"""
+    return isinstance(error, NetworkError) and not isinstance(error, TimedOutError) and "(429)" in str(error)
+
+
+def load_tokens(tokens: str = None, tokens_file: str = None) -> list:
+    """
+    Токены из строки через запятую и/или файла (по одному в строке,
+    строки с # пропускаются). Повторы удаляются
+    """
+    found = []
+    if tokens:
+        found += [token.strip() for token in tokens.split(",")]
+    if tokens_file:
+        with open(tokens_file) as f:
+            found += [line.strip() for line in f if not line.strip().startswith("#")]
+    return list(dict.fromkeys(token for token in found if token))
+
+
+client_pool = None
+
+async def init_client_pool(tokens: list, base_url: str = None):
+    """
+    Создание пула клиентов.
+    Клиент с неверным токеном остаётся в пуле отключённым - анонимный клиент
+    используется, только если токены не заданы совсем
+    """
+    global client_pool
+    clients = []
+
+    if not tokens:
+        logger.warning("No Yandex Music tokens configured, using anonymous client")
+        clients.append(PooledClient("anonymous", ClientAsync(base_url=base_url)))
+
+    for index, token in enumerate(tokens or [], start=1):
+        clients.append(PooledClient(f"token-{index}", ClientAsync(token, base_url=base_url)))
+
+    for entry in clients:
+        YANDEX_CLIENT_UP.labels(entry.name).set(1)
+        try:
+            await entry.client.init()
+            account = entry.client.me.account if entry.client.me else None
+            login = getattr(account, "login", None) if account else None
+            logger.info(f"Yandex client {entry.name} initialized" + (f" ({login})" if login else ""))
+        except UnauthorizedError as e:
+            ERRORS.labels("unauthorized").inc()
+            entry.trip(UNAUTHORIZED_COOLDOWN, f"unauthorized: {e}")
+        except Exception as e:
+            ERRORS.labels("timeout" if isinstance(e, TimedOutError) else "unexpected").inc()
+            entry.trip(THROTTLED_COOLDOWN, f"init error: {e}")
+
+    client_pool = YandexClientPool(clients)
+    logger.info(f"Yandex client pool: {client_pool.healthy} of {len(clients)} clients available")
+    return client_pool